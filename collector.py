@@ -1,12 +1,22 @@
 """
     A simple data collector that prints all data when the simulator ends.
+    Optionally, the data can be streamed to an HDF5 table in fixed-size chunks while the simulation is running.
+
+    Results are stored as a compressed HDF5 table with a time index and one column per src.attr.
+    Each column is stored as a separate data column, use read_results() to load only the columns needed.
+
+    In record mode 'event', only changes of the collected values are stored as (time, signal, value) events.
+    read_results() rebuilds the dense time series for the collector's time steps from these events.
+
+    In record mode 'window', only the min/max/mean/last of each signal over windows of a fixed length are stored,
+    in columns src.attr.min, src.attr.max, src.attr.mean and src.attr.last (indexed by the start of the window).
 """
 
-import collections
 import mosaik_api
+import numpy as np
 import pandas as pd
+import tables
 import warnings
-# import numpy as np
 
 
 META = {
@@ -26,24 +36,134 @@ def format_func(x):
     except TypeError:
         return str(x)
 
+def column_name(src, attr):
+    return '{0}.{1}'.format(src, attr)
+
+# Options for writing the results to the HDFStore.
+H5_TABLE_OPTIONS = { 'format': 'table', 'data_columns': True, 'complib': 'blosc', 'complevel': 5 }
+H5_EVENT_TABLE_OPTIONS = { 'format': 'table', 'data_columns': [ 'signal' ], 'complib': 'blosc', 'complevel': 5 }
+
+RECORD_MODES = [ 'sample', 'event', 'window' ]
+WINDOW_STATS = [ 'min', 'max', 'mean', 'last' ]
+
+def get_collector_info(store, key):
+    '''Return the meta data the Collector stored along with its results (defaults for plain sample tables).'''
+    return getattr( store.get_storer(key).attrs, 'collector_info', { 'mode': 'sample' } )
+
+def densify_events(times, signals, values, info, columns=None):
+    '''Rebuild the dense time series for the collector's time steps from recorded events.
+    Before its first event, a signal has value 0.'''
+    if columns is None:
+        columns = info['columns']
+    codes = { name: i for i, name in enumerate( info['columns'] ) }
+    grid = info['start_time'] + info['step_size']*np.arange( info['n_steps'] )
+
+    data = {}
+    for col in columns:
+        mask = signals == codes[col]
+        event_times = times[mask]
+        event_values = values[mask]
+        # Index of the last event at or before each time step.
+        idx = np.searchsorted( event_times, grid, side='right' ) - 1
+        data[col] = np.where( idx >= 0, event_values[np.maximum( idx, 0 )], 0. )
+
+    return pd.DataFrame( data, index=grid*info['sec_per_mt'], columns=columns )
+
+def read_results(storename, key='Monitor', columns=None):
+    '''Load results written by the Collector as a DataFrame with one column per src.attr.
+    If a list of columns is given, only these columns are read from the store.'''
+    with pd.HDFStore(storename, mode='r') as store:
+        info = get_collector_info(store, key)
+
+        if info['mode'] == 'event':
+            events = store.select(key)
+            return densify_events( events.index.values, events['signal'].values, events['value'].values,
+                info, columns )
+
+        if columns is None:
+            return store.select(key)
+
+        index = store.select_column(key, 'index')
+        return pd.DataFrame( { col: store.select_column(key, col).values for col in columns },
+            index=index.values, columns=columns )
+
+def result_columns(storename, key='Monitor'):
+    '''Return the names of the columns stored by the Collector, without reading any data.'''
+    with pd.HDFStore(storename, mode='r') as store:
+        info = get_collector_info(store, key)
+        if info['mode'] == 'event':
+            return list( info['columns'] )
+        storer = store.get_storer(key)
+        if not storer.is_table:
+            return list( info['columns'] ) # Empty results of a run without steps (see Collector.flush).
+        return list( storer.data_columns )
+
 class Collector(mosaik_api.Simulator):
     def __init__(self):
         super(Collector, self).__init__(META)
         self.eid = None
-        self.data = collections.defaultdict(
-                lambda: collections.defaultdict(list))
-        self.time_list=[]
+        self.columns = {}                   # (src, attr) -> column index in the sample buffer
+        self.values = None                  # float64 sample buffer, one (contiguous) column per signal
+        self.times = None                   # float64 buffer of sample times, shared by all signals
+        self.last_row = None                # last samples before the most recent flush, used for forward-filling None
+        self.n_samples = 0                  # number of samples currently held in the buffers
+
+        self.record_mode = 'sample'         # 'sample' (one sample per step), 'event' (changes only) or 'window' (aggregates)
+        self.event_times = None             # buffers of recorded events (mosaik time, signal index, value)
+        self.event_signals = None
+        self.event_values = None
+        self.event_last = []                # last recorded value per signal
+        self.n_events = 0                   # number of events currently held in the buffers
+        self.start_time = None              # mosaik time of the first step
+        self.n_steps = 0                    # number of steps so far (including flushed steps)
+
+        self.window = None                  # length of aggregation windows in mosaik time (record mode 'window')
+        self.window_start = None            # mosaik time at which the current window started
+        self.window_count = 0               # number of steps in the current window
+        self.window_min = None              # running aggregates of the current window, one entry per signal
+        self.window_max = None
+        self.window_sum = None
+        self.window_last = None             # last known value per signal
 
         self.step_size = None
         self.sec_per_mt = None
+        self.stream_h5 = False              # append chunks to the HDFStore during the simulation
+        self.chunk_size = None              # number of collector steps (events in record mode 'event') per chunk
+        self.n_flushed = 0                  # number of samples/events already written to the HDFStore
+
+    def init(self, sid, step_size, seconds_per_mosaik_timestep=1, print_results=True, save_h5=True, h5_storename='collectorstore', h5_panelname=None,
+             stream_h5=False, chunk_size=1000, buffer_size=1000, record_mode='sample', window=None):
+        if record_mode not in RECORD_MODES:
+            raise RuntimeError("Unknown record mode {0}, must be one of {1}.".format(record_mode, RECORD_MODES))
+        if record_mode == 'window' and not window:
+            raise RuntimeError("Record mode 'window' requires a window length.")
 
-    def init(self, sid, step_size, seconds_per_mosaik_timestep=1, print_results=True, save_h5=True, h5_storename='collectorstore', h5_panelname=None):
         self.step_size = step_size
         self.sec_per_mt = seconds_per_mosaik_timestep
         self.print_results = print_results
         self.save_h5 = save_h5
         self.h5_storename = h5_storename
         self.h5_panelname = h5_panelname
+        self.stream_h5 = stream_h5
+        self.chunk_size = chunk_size
+        self.record_mode = record_mode
+        self.window = window
+
+        # Preallocate the sample/event buffers (in streaming mode they never have to grow).
+        capacity = chunk_size if stream_h5 else buffer_size
+        if self.record_mode == 'event':
+            self.event_times = np.zeros( capacity, dtype=np.int64 )
+            self.event_signals = np.zeros( capacity, dtype=np.int32 )
+            self.event_values = np.zeros( capacity )
+        else:
+            self.values = np.zeros( ( capacity, 0 ), order='F' )
+            self.times = np.zeros( capacity )
+            self.last_row = np.zeros( 0 )
+        if self.record_mode == 'window':
+            self.window_min = np.zeros( 0 )
+            self.window_max = np.zeros( 0 )
+            self.window_sum = np.zeros( 0 )
+            self.window_last = np.zeros( 0 )
         return self.meta
 
     def create(self, num, model):
@@ -55,37 +175,261 @@ class Collector(mosaik_api.Simulator):
         return [{'eid': self.eid, 'type': model}]
 
     def step(self, time, inputs):
-        data = inputs[self.eid]
+        if self.start_time is None:
+            self.start_time = time
+        self.n_steps += 1
+
+        if self.record_mode == 'event':
+            self.record_events(time, inputs[self.eid])
+            if self.stream_h5 and self.n_events >= self.chunk_size:
+                self.flush()
+        else:
+            if self.record_mode == 'window':
+                self.record_window(time, inputs[self.eid])
+            else:
+                self.record_samples(time, inputs[self.eid])
+            if self.stream_h5 and self.n_samples >= self.chunk_size:
+                self.flush()
+
+        return time + self.step_size
+
+    def record_samples(self, time, data):
+        n = self.n_samples
+        if n == len( self.times ):
+            self.grow_rows()
+
+        # Signals that are missing or None keep their last value (rows of the buffer are reused after a flush).
+        self.values[n] = self.values[n - 1] if n > 0 else self.last_row
+
+        for attr, values in data.items():
+            for src, value in values.items():
+                col = self.columns.get( ( src, attr ) )
+                if col is None:
+                    col = self.add_column( src, attr )
+                if value is not None:
+                    self.values[n, col] = value
+        self.times[n] = time*self.sec_per_mt
+        self.n_samples += 1
+
+    def record_events(self, time, data):
         for attr, values in data.items():
             for src, value in values.items():
-                val_list = self.data[src][attr]
                 if value is None:
-                    if len( val_list ) is not 0:
-                        val_list.append( val_list[-1] )
-                        # val_list.append( np.NaN )
-                    else:
-                        val_list.append( 0 )
-                        # val_list.append( np.NaN )
-                else:
-                    val_list.append( value )
-        self.time_list.append(time*self.sec_per_mt)
+                    continue
+                col = self.columns.get( ( src, attr ) )
+                if col is None:
+                    # The first value of a signal is always recorded.
+                    col = self.add_column( src, attr )
+                elif value == self.event_last[col]:
+                    continue
+                self.event_last[col] = value
 
-        return time + self.step_size
+                n = self.n_events
+                if n == len( self.event_times ):
+                    self.grow_events()
+                self.event_times[n] = time
+                self.event_signals[n] = col
+                self.event_values[n] = value
+                self.n_events += 1
+
+    def record_window(self, time, data):
+        if self.window_start is None:
+            self.window_start = time
+        elif time >= self.window_start + self.window:
+            self.emit_window()
+            self.window_start += self.window*( ( time - self.window_start )//self.window )
+
+        for attr, values in data.items():
+            for src, value in values.items():
+                col = self.columns.get( ( src, attr ) )
+                if col is None:
+                    col = self.add_column( src, attr )
+                if value is not None:
+                    self.window_last[col] = value
+
+        # None inputs keep the last known value, so all signals are updated at once.
+        np.minimum( self.window_min, self.window_last, out=self.window_min )
+        np.maximum( self.window_max, self.window_last, out=self.window_max )
+        self.window_sum += self.window_last
+        self.window_count += 1
+
+    def emit_window(self):
+        '''Store the aggregates of the current window as one row of the sample buffers and reset them.'''
+        n = self.n_samples
+        if n == len( self.times ):
+            self.grow_rows()
+
+        width = len( WINDOW_STATS )
+        self.values[n, 0::width] = self.window_min
+        self.values[n, 1::width] = self.window_max
+        self.values[n, 2::width] = self.window_sum/self.window_count
+        self.values[n, 3::width] = self.window_last
+        self.times[n] = self.window_start*self.sec_per_mt
+        self.n_samples += 1
+
+        self.window_min[:] = np.inf
+        self.window_max[:] = -np.inf
+        self.window_sum[:] = 0.
+        self.window_count = 0
+
+    def add_column(self, src, attr):
+        '''Register a new signal. Its samples before the first step it was seen in are 0.'''
+        if self.stream_h5 and self.n_flushed > 0 and self.record_mode != 'event':
+            # The columns of the HDF5 table are fixed by the first chunk.
+            raise RuntimeError("Signal {0} first received after the first chunk has been written, all signals "
+                "have to be received in the first step.".format(column_name(src, attr)))
+        col = len( self.columns )
+        self.columns[( src, attr )] = col
+
+        if self.record_mode == 'event':
+            self.event_last.append( None )
+            return col
+
+        width = len( WINDOW_STATS ) if self.record_mode == 'window' else 1
+        values = np.zeros( ( self.values.shape[0], ( col + 1 )*width ), order='F' )
+        values[:, :col*width] = self.values
+        self.values = values
+        self.last_row = np.append( self.last_row, 0. )
+
+        if self.record_mode == 'window':
+            # Earlier steps of the current window count as 0 for the new signal.
+            self.window_min = np.append( self.window_min, 0. if self.window_count > 0 else np.inf )
+            self.window_max = np.append( self.window_max, 0. if self.window_count > 0 else -np.inf )
+            self.window_sum = np.append( self.window_sum, 0. )
+            self.window_last = np.append( self.window_last, 0. )
+        return col
+
+    def grow_rows(self):
+        '''Double the capacity of the sample buffers.'''
+        capacity = max( 2*len( self.times ), 1 )
+
+        values = np.zeros( ( capacity, self.values.shape[1] ), order='F' )
+        values[:self.n_samples] = self.values[:self.n_samples]
+        self.values = values
+
+        times = np.zeros( capacity )
+        times[:self.n_samples] = self.times[:self.n_samples]
+        self.times = times
+
+    def grow_events(self):
+        '''Double the capacity of the event buffers.'''
+        n = self.n_events
+        capacity = max( 2*n, 1 )
+        for name in [ 'event_times', 'event_signals', 'event_values' ]:
+            old = getattr( self, name )
+            new = np.zeros( capacity, dtype=old.dtype )
+            new[:n] = old[:n]
+            setattr( self, name, new )
+
+    def get_columns(self):
+        '''Names of the stored columns, in the order of the sample buffer.'''
+        if self.record_mode == 'window':
+            return [ '{0}.{1}'.format( column_name(src, attr), stat )
+                for ( src, attr ) in self.columns for stat in WINDOW_STATS ]
+        return [ column_name(src, attr) for ( src, attr ) in self.columns ]
+
+    def get_info(self):
+        '''Meta data stored along with the results.'''
+        return {
+            'mode': self.record_mode,
+            'columns': self.get_columns(),
+            'start_time': self.start_time if self.start_time is not None else 0,
+            'step_size': self.step_size,
+            'n_steps': self.n_steps,
+            'sec_per_mt': self.sec_per_mt,
+            'window': self.window
+            }
+
+    def get_frame(self):
+        '''Return the buffered samples as a DataFrame with one column per src.attr.
+        In record mode 'sample' or 'window', the DataFrame is a view on the sample buffers, no data is copied.'''
+        if self.record_mode == 'event':
+            n = self.n_events
+            return densify_events( self.event_times[:n], self.event_signals[:n], self.event_values[:n],
+                self.get_info() )
+
+        n = self.n_samples
+        return pd.DataFrame( self.values[:n], index=self.times[:n], columns=self.get_columns(), copy=False )
+
+    def flush(self):
+        '''Append all buffered samples (or events) to the HDFStore table and clear the buffers.
+        The store is closed after each chunk, so that the data written so far survives a crash.'''
+        if self.record_mode == 'event':
+            n = self.n_events
+            df = pd.DataFrame( { 'signal': self.event_signals[:n], 'value': self.event_values[:n] },
+                index=self.event_times[:n] )
+            options = H5_EVENT_TABLE_OPTIONS
+        else:
+            n = self.n_samples
+            df = self.get_frame()
+            df = df.reindex( columns=sorted( df.columns ) )
+            options = H5_TABLE_OPTIONS
+
+        # A run without events still gets an (empty) table, which holds the collector info: PyTables
+        # cannot append empty frames, so a placeholder event is written and removed again.
+        placeholder = self.record_mode == 'event' and n == 0 and self.n_flushed == 0
+        if placeholder:
+            df = pd.DataFrame( { 'signal': np.zeros( 1, dtype=self.event_signals.dtype ), 'value': np.zeros( 1 ) },
+                index=np.zeros( 1, dtype=self.event_times.dtype ) )
+        elif n == 0 and self.n_flushed == 0:
+            # Same for a run without any steps in record mode 'sample' or 'window', whose (empty) table
+            # has no columns at all, so that it is stored in fixed format.
+            self.put_empty(df)
+            return
+
+        with warnings.catch_warnings():
+            # Column names 'src.attr' are not valid Python identifiers, which PyTables warns about.
+            warnings.filterwarnings( 'ignore', category=tables.NaturalNameWarning )
+
+            with pd.HDFStore(self.h5_storename) as store:
+                if self.n_flushed == 0 and self.h5_panelname in store:
+                    store.remove(self.h5_panelname)
+                if n > 0 or placeholder:
+                    # Indexes are only created once, when the simulation has finished (see finalize).
+                    store.append(self.h5_panelname, df, index=False, **options)
+                if placeholder:
+                    store.remove(self.h5_panelname, start=0, stop=1)
+                store.get_storer(self.h5_panelname).attrs.collector_info = self.get_info()
+
+        self.n_flushed += n
+        if self.record_mode == 'event':
+            self.n_events = 0
+        elif n > 0:
+            self.last_row = self.values[n - 1].copy()
+            self.n_samples = 0
+
+    def put_empty(self, df):
+        '''Store an empty frame (and the collector info) in fixed format.'''
+        with pd.HDFStore(self.h5_storename) as store:
+            if self.h5_panelname in store:
+                store.remove(self.h5_panelname)
+            store.put(self.h5_panelname, df, format='fixed')
+            store.get_storer(self.h5_panelname).attrs.collector_info = self.get_info()
+
+    def create_index(self):
+        '''Create the PyTables indexes of the table's data columns (skipped by the appends in flush).'''
+        if self.n_flushed == 0:
+            return
+        with warnings.catch_warnings():
+            warnings.filterwarnings( 'ignore', category=tables.NaturalNameWarning )
+            with pd.HDFStore(self.h5_storename) as store:
+                store.create_table_index(self.h5_panelname, columns=True)
 
     def finalize(self):
-        if self.print_results:
-            print('Collected data:')
-            for sim, sim_data in sorted(self.data.items()):
-                print('- {0}'.format(sim))
-                for attr, values in sorted(sim_data.items()):
-                    print('  - {0}: {1}'.format(attr, list(map(format_func, values))))
-        if self.save_h5:
-            with warnings.catch_warnings():
-                warnings.filterwarnings( 'ignore', category=FutureWarning )
-
-                store = pd.HDFStore(self.h5_storename)
-                store[self.h5_panelname] = pd.Panel.from_dict({k: pd.DataFrame(v, index=self.time_list) for k,v in self.data.items()})
-                store.close()
+        if self.record_mode == 'window' and self.window_count > 0:
+            self.emit_window()
+        if self.print_results and not self.stream_h5:
+            self.print_frame(self.get_frame())
+        if self.save_h5 or self.stream_h5:
+            self.flush()
+            self.create_index()
+        if self.print_results and self.stream_h5:
+            self.print_frame(read_results(self.h5_storename, self.h5_panelname))
+
+    def print_frame(self, df):
+        print('Collected data:')
+        for col in sorted(df.columns):
+            print('- {0}: {1}'.format(col, list(map(format_func, df[col]))))
 
 if __name__ == '__main__':
     mosaik_api.start_simulation(Collector())
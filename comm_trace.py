@@ -0,0 +1,59 @@
+"""
+    Binary traces of messages delivered by the communication network (compatible with Python 2 and 3).
+    Each record holds the channel, send time, delivery time (both in seconds) and random seed of a message.
+"""
+
+import struct
+
+
+# Channels (messages sent via attribute <channel>_send are received via <channel>_receive).
+TRACE_CHANNELS = [ 'u3', 'u4', 'ctrl' ]
+
+TRACE_MAGIC = b'TC3TRACE'
+TRACE_VERSION = 1
+
+# File header (magic, version) and records (channel index, send time, delivery time, seed), little-endian and packed.
+TRACE_HEADER = struct.Struct( '<8sI' )
+TRACE_RECORD = struct.Struct( '<Bddi' )
+
+
+class TraceWriter(object):
+    """
+        Writes a trace file record by record.
+    """
+
+    def __init__( self, filename ):
+        self.file = open( filename, 'wb' )
+        self.file.write( TRACE_HEADER.pack( TRACE_MAGIC, TRACE_VERSION ) )
+        self.n_records = 0
+
+
+    def write( self, channel, send_time, delivery_time, seed ):
+        self.file.write( TRACE_RECORD.pack( TRACE_CHANNELS.index( channel ), send_time, delivery_time, seed ) )
+        self.n_records += 1
+
+
+    def close( self ):
+        self.file.close()
+
+
+def read_trace( filename ):
+    '''Return the records of a trace file as memory-mapped NumPy structured array
+    (with fields channel, send_time, delivery_time and seed).'''
+    import numpy as np
+
+    with open( filename, 'rb' ) as f:
+        ( magic, version ) = TRACE_HEADER.unpack( f.read( TRACE_HEADER.size ) )
+    if magic != TRACE_MAGIC or version != TRACE_VERSION:
+        raise RuntimeError( 'not a trace file (version {0}): {1}'.format( TRACE_VERSION, filename ) )
+
+    dtype = np.dtype( [ ( 'channel', '<u1' ), ( 'send_time', '<f8' ), ( 'delivery_time', '<f8' ), ( 'seed', '<i4' ) ] )
+    assert dtype.itemsize == TRACE_RECORD.size
+
+    with open( filename, 'rb' ) as f:
+        f.seek( 0, 2 )
+        n_records = ( f.tell() - TRACE_HEADER.size ) // dtype.itemsize
+    if n_records == 0:
+        return np.zeros( 0, dtype=dtype )
+
+    return np.memmap( filename, dtype=dtype, mode='r', offset=TRACE_HEADER.size, shape=( n_records, ) )
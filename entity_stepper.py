@@ -0,0 +1,44 @@
+"""
+    Stepping of the entities of a simulator on a pool of threads (compatible with Python 2 and 3).
+"""
+
+from multiprocessing.pool import ThreadPool
+
+
+class EntityStepper(object):
+    """
+        Calls a function for each entity of a simulator, either one after the other or (with *n_threads* > 1)
+        on a pool of threads. Threads only run at the same time while they are in native code that releases
+        the GIL (e.g., FMU functions called via ctypes).
+
+        The function must only change the state of its own entity. Results are returned in the order of the
+        sorted entity IDs, so that simulators can merge them in the same order whatever the number of threads.
+    """
+
+    def __init__( self, n_threads=0 ):
+        self.n_threads = n_threads
+        self.pool = ThreadPool( n_threads ) if n_threads > 1 else None
+
+
+    def map( self, func, eids ):
+        '''Return the list of results of func(eid) for the given entity IDs, in sorted order of the IDs.'''
+        eids = sorted( eids )
+        if self.pool is None or len( eids ) < 2:
+            return [ func( eid ) for eid in eids ]
+        return self.pool.map( func, eids, chunksize=1 )
+
+
+    def close( self ):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+def warn_gil_bound( n_threads, simulator_name ):
+    '''Warn that a simulator whose FMUs are called via the FMI++ Python bindings (SWIG) may not gain from
+    threads: unless the bindings are built with thread support, they hold the GIL during FMU calls.'''
+    if n_threads > 1:
+        print( 'WARNING: {0} calls its FMUs via the FMI++ Python bindings, which may not release the GIL: '
+            'with n_threads={1}, the FMUs may not run in parallel (use n_threads=0 unless the bindings '
+            'are known to release it)'.format( simulator_name, n_threads ) )
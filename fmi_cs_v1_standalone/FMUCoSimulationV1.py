@@ -125,26 +125,35 @@ class FMUCoSimulationV1:
         # Retrieve dict of variable names and value references.
         scalar_variables = self.fmu_model_description.find( 'ModelVariables' ).getchildren()
         self.fmu_var_dict = dict()
+        self.fmu_var_types = dict()
         for var in scalar_variables:
             self.fmu_var_dict[ var.get( 'name' ) ] = int( var.get( 'valueReference' ) )
+            self.fmu_var_types[ var.get( 'name' ) ] = var[0].tag if len( var ) > 0 else None
+
+        # Value references and value buffers (see getReal, setReal, etc.) and call plans (see getValues and
+        # setValues) for groups of variables, created on first use.
+        self.fmu_var_buffers = dict()
+        self.fmu_call_plans = dict()
 
 
     def __init_functions( self ):
+        # The FMU functions are retrieved from the shared library only once and stored as attributes.
+
         # Specify function fmiGetVersion
         func_name_get_version = self.fmu_name + '_fmiGetVersion'
-        func_get_version = getattr( self.fmu_shared_library, func_name_get_version )
-        func_get_version.restype = c_char_p
+        self.func_get_version = getattr( self.fmu_shared_library, func_name_get_version )
+        self.func_get_version.restype = c_char_p
 
         # Specify function fmiGetTypesPlatform
         func_name_types_get_platform = self.fmu_name + '_fmiGetTypesPlatform'
-        func_types_get_platform = getattr( self.fmu_shared_library, func_name_types_get_platform )
-        func_types_get_platform.restype = c_char_p
+        self.func_types_get_platform = getattr( self.fmu_shared_library, func_name_types_get_platform )
+        self.func_types_get_platform.restype = c_char_p
 
         # Specify function fmiInstantiateSlave
         func_name_instantiate_slave = self.fmu_name + '_fmiInstantiateSlave'
-        func_instantiate_slave = getattr( self.fmu_shared_library, func_name_instantiate_slave )
-        func_instantiate_slave.restype = c_void_p # fmiComponent
-        func_instantiate_slave.argtypes = (
+        self.func_instantiate_slave = getattr( self.fmu_shared_library, func_name_instantiate_slave )
+        self.func_instantiate_slave.restype = c_void_p # fmiComponent
+        self.func_instantiate_slave.argtypes = (
             c_char_p, # fmiString instanceName
             c_char_p, # fmiString fmuGUID
             c_char_p, # fmiString fmuLocation
@@ -158,9 +167,9 @@ class FMUCoSimulationV1:
 
         # Specify function fmiInitializeSlave
         func_name_initialize_slave = self.fmu_name + '_fmiInitializeSlave'
-        func_initialize_slave = getattr( self.fmu_shared_library, func_name_initialize_slave )
-        func_initialize_slave.restype = c_int # fmiStatus
-        func_initialize_slave.argtypes = (
+        self.func_initialize_slave = getattr( self.fmu_shared_library, func_name_initialize_slave )
+        self.func_initialize_slave.restype = c_int # fmiStatus
+        self.func_initialize_slave.argtypes = (
             c_void_p, # fmiComponent c
             c_double, # fmiReal tStart
             c_char, # fmiBoolean StopTimeDefined
@@ -169,25 +178,25 @@ class FMUCoSimulationV1:
 
         # Specify function fmiTerminateSlave
         func_name_terminate_slave = self.fmu_name + '_fmiTerminateSlave'
-        func_terminate_slave = getattr( self.fmu_shared_library, func_name_terminate_slave )
-        func_terminate_slave.restype = c_int # fmiStatus
-        func_terminate_slave.argtypes = (
+        self.func_terminate_slave = getattr( self.fmu_shared_library, func_name_terminate_slave )
+        self.func_terminate_slave.restype = c_int # fmiStatus
+        self.func_terminate_slave.argtypes = (
             c_void_p, # fmiComponent c
             )
 
         # Specify function fmiFreeSlaveInstance
         func_name_free_slave_instance = self.fmu_name + '_fmiFreeSlaveInstance'
-        func_free_slave_instance = getattr( self.fmu_shared_library, func_name_free_slave_instance )
-        func_free_slave_instance.restype = None # void
-        func_free_slave_instance.argtypes = (
+        self.func_free_slave_instance = getattr( self.fmu_shared_library, func_name_free_slave_instance )
+        self.func_free_slave_instance.restype = None # void
+        self.func_free_slave_instance.argtypes = (
             c_void_p, # fmiComponent c
             )
 
         # Specify function fmiSetReal
         func_name_set_real = self.fmu_name + '_fmiSetReal'
-        func_set_real = getattr( self.fmu_shared_library, func_name_set_real )
-        func_set_real.restype = c_int # fmiStatus
-        func_set_real.argtypes = (
+        self.func_set_real = getattr( self.fmu_shared_library, func_name_set_real )
+        self.func_set_real.restype = c_int # fmiStatus
+        self.func_set_real.argtypes = (
             c_void_p, # fmiComponent c
             POINTER( c_int ), # const fmiValueReference vr[]
             c_size_t, # size_t nvr
@@ -196,9 +205,9 @@ class FMUCoSimulationV1:
 
         # Specify function fmiGetReal
         func_name_get_real = self.fmu_name + '_fmiGetReal'
-        func_get_real = getattr( self.fmu_shared_library, func_name_get_real )
-        func_get_real.restype = c_int # fmiStatus
-        func_get_real.argtypes = (
+        self.func_get_real = getattr( self.fmu_shared_library, func_name_get_real )
+        self.func_get_real.restype = c_int # fmiStatus
+        self.func_get_real.argtypes = (
             c_void_p, # fmiComponent c
             POINTER( c_int ), # const fmiValueReference vr[]
             c_size_t, # size_t nvr
@@ -207,9 +216,9 @@ class FMUCoSimulationV1:
 
         # Specify function fmiSetInteger
         func_name_set_integer = self.fmu_name + '_fmiSetInteger'
-        func_set_integer = getattr( self.fmu_shared_library, func_name_set_integer )
-        func_set_integer.restype = c_int # fmiStatus
-        func_set_integer.argtypes = (
+        self.func_set_integer = getattr( self.fmu_shared_library, func_name_set_integer )
+        self.func_set_integer.restype = c_int # fmiStatus
+        self.func_set_integer.argtypes = (
             c_void_p, # fmiComponent c
             POINTER( c_int ), # const fmiValueReference vr[]
             c_size_t, # size_t nvr
@@ -218,9 +227,9 @@ class FMUCoSimulationV1:
 
         # Specify function fmiGetInteger
         func_name_get_integer = self.fmu_name + '_fmiGetInteger'
-        func_get_integer = getattr( self.fmu_shared_library, func_name_get_integer )
-        func_get_integer.restype = c_int # fmiStatus
-        func_get_integer.argtypes = (
+        self.func_get_integer = getattr( self.fmu_shared_library, func_name_get_integer )
+        self.func_get_integer.restype = c_int # fmiStatus
+        self.func_get_integer.argtypes = (
             c_void_p, # fmiComponent c
             POINTER( c_int ), # const fmiValueReference vr[]
             c_size_t, # size_t nvr
@@ -229,9 +238,9 @@ class FMUCoSimulationV1:
 
         # Specify function fmiDoStep
         func_name_do_step = self.fmu_name + '_fmiDoStep'
-        func_do_step = getattr( self.fmu_shared_library, func_name_do_step )
-        func_do_step.restype = c_int # fmiStatus
-        func_do_step.argtypes = (
+        self.func_do_step = getattr( self.fmu_shared_library, func_name_do_step )
+        self.func_do_step.restype = c_int # fmiStatus
+        self.func_do_step.argtypes = (
             c_void_p, # fmiComponent c
             c_double, # fmiReal currentCommunicationPoint
             c_double, # fmiReal communicationStepSize
@@ -240,15 +249,11 @@ class FMUCoSimulationV1:
 
 
     def getVersion( self ):
-        func_name_get_version = self.fmu_name + '_fmiGetVersion'
-        func_get_version = getattr( self.fmu_shared_library, func_name_get_version )
-        return func_get_version()
+        return self.func_get_version()
 
 
     def getTypesPlatform( self ):
-        func_name_types_get_platform = self.fmu_name + '_fmiGetTypesPlatform'
-        func_types_get_platform = getattr( self.fmu_shared_library, func_name_types_get_platform )
-        return func_types_get_platform()
+        return self.func_types_get_platform()
 
 
     def instantiateSlave( self, name, timeout = 0., visible = False, interactive = False, logging_on = False ):
@@ -263,9 +268,7 @@ class FMUCoSimulationV1:
             raise RuntimeError( 'XML model description has no element called "Implementation/CoSimulation_Tool/Model"' )
         fmu_mime_type = model_info.get( 'type' )
 
-        func_name_instantiate_slave = self.fmu_name + '_fmiInstantiateSlave'
-        func_instantiate_slave = getattr( self.fmu_shared_library, func_name_instantiate_slave )
-        self.fmi_component = func_instantiate_slave(
+        self.fmi_component = self.func_instantiate_slave(
             c_char_p( name ),
             c_char_p( fmu_guid ),
             c_char_p( fmu_uri ),
@@ -279,9 +282,7 @@ class FMUCoSimulationV1:
 
 
     def initializeSlave( self, start_time, stop_time_defined = False, stop_time = 0. ):
-        func_name_initialize_slave = self.fmu_name + '_fmiInitializeSlave'
-        func_initialize_slave = getattr( self.fmu_shared_library, func_name_initialize_slave )
-        status = func_initialize_slave(
+        status = self.func_initialize_slave(
             self.fmi_component,
             c_double( start_time ),
             c_char( self.fmi_true if stop_time_defined is True else self.fmi_false ),
@@ -292,114 +293,91 @@ class FMUCoSimulationV1:
 
 
     def getReal( self, var_names ):
-        # Get the number of variables.
-        n_vars = len( var_names )
-
-        # Retrieve the value references.
-        var_ref_ids = []
-        for name in var_names:
-            var_ref_ids.append( self.fmu_var_dict[ name ] )
-
-        var_values = ( c_double * n_vars )()
+        # Retrieve the (cached) value references and value buffer.
+        ( var_refs, n_vars, var_values ) = self.__get_buffers( var_names, c_double )
 
         # Call FMU function.
-        func_name_get_real = self.fmu_name + '_fmiGetReal'
-        func_get_real = getattr( self.fmu_shared_library, func_name_get_real )
-        status = func_get_real(
-            self.fmi_component,
-            ( c_int * n_vars )( *var_ref_ids ),
-            c_size_t( n_vars ),
-            var_values
-            )
+        status = self.func_get_real( self.fmi_component, var_refs, n_vars, var_values )
 
         # Check the FMU status.
         assert( status == self.fmi_ok  )
 
-        return list( var_values )
+        return var_values[:]
 
 
     def setReal( self, var_names, var_values ):
-        # Get the number of variables.
-        n_vars = len( var_names )
-
-        # Retrieve the value references.
-        var_ref_ids = []
-        for name in var_names:
-            var_ref_ids.append( self.fmu_var_dict[ name ] )
+        # Retrieve the (cached) value references and value buffer.
+        ( var_refs, n_vars, var_buffer ) = self.__get_buffers( var_names, c_double )
+        var_buffer[:] = var_values
 
         # Call FMU function.
-        func_name_set_real = self.fmu_name + '_fmiSetReal'
-        func_set_real = getattr( self.fmu_shared_library, func_name_set_real )
-        status = func_set_real(
-            self.fmi_component,
-            ( c_int * n_vars )( *var_ref_ids ),
-            c_size_t( n_vars ),
-            ( c_double * n_vars )( *var_values )
-            )
+        status = self.func_set_real( self.fmi_component, var_refs, n_vars, var_buffer )
 
         # Check the FMU status.
         assert( status == self.fmi_ok  )
 
 
     def getInteger( self, var_names ):
-        # Get the number of variables.
-        n_vars = len( var_names )
-
-        # Retrieve the value references.
-        var_ref_ids = []
-        for name in var_names:
-            var_ref_ids.append( self.fmu_var_dict[ name ] )
-
-        var_values = ( c_int * n_vars )()
+        # Retrieve the (cached) value references and value buffer.
+        ( var_refs, n_vars, var_values ) = self.__get_buffers( var_names, c_int )
 
         # Call FMU function.
-        func_name_get_integer = self.fmu_name + '_fmiGetInteger'
-        func_get_integer = getattr( self.fmu_shared_library, func_name_get_integer )
-        status = func_get_integer(
-            self.fmi_component,
-            ( c_int * n_vars )( *var_ref_ids ),
-            c_size_t( n_vars ),
-            var_values
-            )
+        status = self.func_get_integer( self.fmi_component, var_refs, n_vars, var_values )
 
         # Check the FMU status.
         assert( status == self.fmi_ok  )
 
-        return list( var_values )
+        return var_values[:]
 
 
     def setInteger( self, var_names, var_values ):
-        # Get the number of variables.
-        n_vars = len( var_names )
-
-        # Retrieve the value references.
-        var_ref_ids = []
-        for name in var_names:
-            var_ref_ids.append( self.fmu_var_dict[ name ] )
+        # Retrieve the (cached) value references and value buffer.
+        ( var_refs, n_vars, var_buffer ) = self.__get_buffers( var_names, c_int )
+        var_buffer[:] = var_values
 
         # Call FMU function.
-        func_name_set_integer = self.fmu_name + '_fmiSetInteger'
-        func_set_integer = getattr( self.fmu_shared_library, func_name_set_integer )
-        status = func_set_integer(
-            self.fmi_component,
-            ( c_int * n_vars )( *var_ref_ids ),
-            c_size_t( n_vars ),
-            ( c_int * n_vars )( *var_values )
-            )
+        status = self.func_set_integer( self.fmi_component, var_refs, n_vars, var_buffer )
 
         # Check the FMU status.
         assert( status == self.fmi_ok  )
 
 
-    def doStep( self, current_communication_point, communication_step_size, new_step = True ):
+    def getValues( self, var_names ):
+        '''Get the values of variables of mixed types (Real and Integer), with one FMU function call per type.
+        Returns the values in the order of the variable names.'''
+        var_values = [ None ] * len( var_names )
 
-        func_name_do_step = self.fmu_name + '_fmiDoStep'
-        func_do_step = getattr( self.fmu_shared_library, func_name_do_step )
-        status = func_do_step(
+        for ( positions, var_refs, n_vars, var_buffer, func_get, _ ) in self.__get_call_plan( var_names ):
+            # Call FMU function.
+            status = func_get( self.fmi_component, var_refs, n_vars, var_buffer )
+
+            # Check the FMU status.
+            assert( status == self.fmi_ok  )
+
+            for ( pos, value ) in zip( positions, var_buffer ):
+                var_values[pos] = value
+
+        return var_values
+
+
+    def setValues( self, var_names, var_values ):
+        '''Set the values of variables of mixed types (Real and Integer), with one FMU function call per type.'''
+        for ( positions, var_refs, n_vars, var_buffer, _, func_set ) in self.__get_call_plan( var_names ):
+            var_buffer[:] = [ var_values[pos] for pos in positions ]
+
+            # Call FMU function.
+            status = func_set( self.fmi_component, var_refs, n_vars, var_buffer )
+
+            # Check the FMU status.
+            assert( status == self.fmi_ok  )
+
+
+    def doStep( self, current_communication_point, communication_step_size, new_step = True ):
+        status = self.func_do_step(
             self.fmi_component,
-            c_double( current_communication_point ),
-            c_double( communication_step_size ),
-            c_char( self.fmi_true if new_step is True else self.fmi_false )
+            current_communication_point,
+            communication_step_size,
+            self.fmi_true if new_step is True else self.fmi_false
             )
 
         # Check the FMU status.
@@ -407,10 +385,7 @@ class FMUCoSimulationV1:
 
 
     def terminateSlave( self ):
-
-        func_name_terminate_slave = self.fmu_name + '_fmiTerminateSlave'
-        func_terminate_slave = getattr( self.fmu_shared_library, func_name_terminate_slave )
-        status = func_terminate_slave(
+        status = self.func_terminate_slave(
             self.fmi_component
             )
 
@@ -419,12 +394,50 @@ class FMUCoSimulationV1:
 
 
     def freeSlaveInstance( self ):
-
-        func_name_free_slave_instance = self.fmu_name + '_fmiFreeSlaveInstance'
-        func_free_slave_instance = getattr( self.fmu_shared_library, func_name_free_slave_instance )
-        func_free_slave_instance(
+        self.func_free_slave_instance(
             self.fmi_component
             )
 
         self.fmi_component = None
 
+
+    def __get_buffers( self, var_names, c_type ):
+        # Value references and value buffers are created once per group of variables and then reused.
+        key = ( tuple( var_names ), c_type )
+        try:
+            return self.fmu_var_buffers[ key ]
+        except KeyError:
+            pass
+
+        n_vars = len( var_names )
+        var_refs = ( c_int * n_vars )( *[ self.fmu_var_dict[ name ] for name in var_names ] )
+        self.fmu_var_buffers[ key ] = ( var_refs, n_vars, ( c_type * n_vars )() )
+        return self.fmu_var_buffers[ key ]
+
+
+    def __get_call_plan( self, var_names ):
+        # Split a group of variables of mixed types into one call per type (created once per group and then reused).
+        key = tuple( var_names )
+        try:
+            return self.fmu_call_plans[ key ]
+        except KeyError:
+            pass
+
+        typed_functions = {
+            'Real': ( c_double, self.func_get_real, self.func_set_real ),
+            'Integer': ( c_int, self.func_get_integer, self.func_set_integer )
+            }
+
+        for name in key:
+            if self.fmu_var_types[ name ] not in typed_functions:
+                raise RuntimeError( 'variable type not supported: {} ({})'.format( name, self.fmu_var_types[ name ] ) )
+
+        plan = []
+        for ( var_type, ( c_type, func_get, func_set ) ) in typed_functions.items():
+            positions = [ pos for ( pos, name ) in enumerate( key ) if self.fmu_var_types[ name ] == var_type ]
+            if positions:
+                ( var_refs, n_vars, var_buffer ) = self.__get_buffers( [ key[pos] for pos in positions ], c_type )
+                plan.append( ( positions, var_refs, n_vars, var_buffer, func_get, func_set ) )
+
+        self.fmu_call_plans[ key ] = plan
+        return plan
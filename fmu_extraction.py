@@ -0,0 +1,159 @@
+"""
+    Cached extraction of FMUs.
+    An FMU is only unpacked if its extracted tree does not match the archive anymore (compatible with Python 2 and 3).
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+
+try:
+    from urllib.parse import urljoin
+    from urllib.request import pathname2url
+except ImportError: # Python 2
+    from urlparse import urljoin
+    from urllib import pathname2url
+
+from result_cache import file_digest
+
+
+# Name of the file (inside the extracted tree) recording the archive it was extracted from.
+STAMP_FILE_NAME = '.fmu_stamp'
+
+# Maximum time (in seconds) to wait for a concurrent run that is replacing an outdated extracted tree.
+REPLACE_TIMEOUT = 10.
+
+
+def get_stamp( path_to_fmu ):
+    '''Return the stamp (size, mtime and digest) of an FMU archive.'''
+    stat = os.stat( path_to_fmu )
+    return dict( size=stat.st_size, mtime=stat.st_mtime, digest=file_digest( path_to_fmu ) )
+
+
+def read_stamp( extract_dir ):
+    '''Return the stamp of an extracted tree, or None if there is none.'''
+    try:
+        with open( os.path.join( extract_dir, STAMP_FILE_NAME ) ) as f:
+            return json.load( f )
+    except ( IOError, OSError, ValueError ):
+        return None
+
+
+def write_stamp( extract_dir, stamp ):
+    tmp_path = os.path.join( extract_dir, STAMP_FILE_NAME + '.tmp' )
+    with open( tmp_path, 'w' ) as f:
+        json.dump( stamp, f )
+    if os.path.exists( os.path.join( extract_dir, STAMP_FILE_NAME ) ):
+        os.remove( os.path.join( extract_dir, STAMP_FILE_NAME ) )
+    os.rename( tmp_path, os.path.join( extract_dir, STAMP_FILE_NAME ) )
+
+
+def is_current( extract_dir, path_to_fmu ):
+    '''Check if the extracted tree matches the FMU archive. The archive is only hashed if its size or mtime
+    differ from the stamp (e.g., after copying it), in which case the stamp is updated.'''
+    stamp = read_stamp( extract_dir )
+    if stamp is None:
+        return False
+
+    stat = os.stat( path_to_fmu )
+    if stamp.get( 'size' ) == stat.st_size and stamp.get( 'mtime' ) == stat.st_mtime:
+        return True
+
+    if stamp.get( 'digest' ) == file_digest( path_to_fmu ):
+        try:
+            write_stamp( extract_dir, get_stamp( path_to_fmu ) )
+        except ( IOError, OSError ): # Stamp updated by a concurrent run.
+            pass
+        return True
+
+    return False
+
+
+def is_being_replaced( output_dir, model_name ):
+    '''Return True while a run is replacing the extracted tree of an FMU (see extract_fmu).'''
+    prefix = '.' + model_name + '-old-'
+    return any( name.startswith( prefix ) for name in os.listdir( output_dir ) )
+
+
+def wait_for_replacement( extract_dir, output_dir, model_name, timeout=REPLACE_TIMEOUT ):
+    '''Wait while the extracted tree is missing because a concurrent run is replacing it.'''
+    deadline = time.time() + timeout
+    while not os.path.isdir( extract_dir ) and is_being_replaced( output_dir, model_name ) and time.time() < deadline:
+        time.sleep( 0.01 )
+
+
+def extract_fmu( path_to_fmu, output_dir, command=None, verbose=False ):
+    '''Extract an FMU to sub-directory *output_dir*/<model name> (like fmipp.extractFMU) and return the URI
+    to the extracted FMU, or None if the FMU could not be extracted.
+
+    Extraction is skipped if the extracted tree is still current. Otherwise, the FMU is extracted to a
+    temporary directory that is then renamed into place, so that concurrent runs never see a partially
+    extracted tree. An outdated tree is moved to a directory .<model name>-old-*, which exists until the new
+    tree is in place, so that concurrent runs wait for the new tree instead of extracting the FMU again.
+
+    The command for unzipping can be given as a string, using tags '{fmu}' and '{dir}' as placeholders
+    for the FMU file path and the output directory (e.g., 'unzip -q -o {fmu} -d {dir}').
+    '''
+    if not zipfile.is_zipfile( path_to_fmu ):
+        print( '{} is not a valid ZIP archive'.format( path_to_fmu ) )
+        return None
+
+    if not os.path.isdir( output_dir ):
+        print( '{} is not a valid path'.format( output_dir ) )
+        return None
+
+    model_name = os.path.splitext( os.path.basename( path_to_fmu ) )[0]
+    extract_dir = os.path.join( output_dir, model_name )
+    uri_to_extracted_fmu = urljoin( 'file:', pathname2url( extract_dir ) )
+
+    wait_for_replacement( extract_dir, output_dir, model_name )
+    if is_current( extract_dir, path_to_fmu ):
+        if verbose: print( 'FMU {} has already been extracted to {}'.format( path_to_fmu, extract_dir ) )
+        return uri_to_extracted_fmu
+
+    if verbose: print( 'Extracting FMU {} to {}'.format( path_to_fmu, extract_dir ) )
+
+    # Extract to a temporary directory next to the target directory (i.e., on the same file system).
+    stamp = get_stamp( path_to_fmu )
+    tmp_dir = tempfile.mkdtemp( dir=output_dir, prefix='.' + model_name + '-new-' )
+    old_dir = None
+    try:
+        os.chmod( tmp_dir, 0o755 ) # Directories created by mkdtemp are only accessible by the owner.
+        if command is None:
+            with zipfile.ZipFile( path_to_fmu, 'r' ) as fmu:
+                fmu.extractall( tmp_dir )
+        elif os.system( command.format( fmu=path_to_fmu, dir=tmp_dir ) ) != 0:
+            raise RuntimeError( 'failed to extract FMU {} with command: {}'.format( path_to_fmu, command ) )
+        write_stamp( tmp_dir, stamp )
+
+        # A concurrent run may have put a current tree into place meanwhile, which is kept (and
+        # the temporary directory discarded).
+        wait_for_replacement( extract_dir, output_dir, model_name )
+        if is_current( extract_dir, path_to_fmu ):
+            if verbose: print( 'FMU {} has been extracted to {} concurrently'.format( path_to_fmu, extract_dir ) )
+            return uri_to_extracted_fmu
+
+        # Move an outdated tree out of the way and rename the new tree into place. The old tree is only
+        # deleted afterwards (see is_being_replaced).
+        if os.path.isdir( extract_dir ):
+            old_dir = tempfile.mkdtemp( dir=output_dir, prefix='.' + model_name + '-old-' )
+            try:
+                os.rename( extract_dir, os.path.join( old_dir, model_name ) )
+            except OSError: # Moved by a concurrent run.
+                pass
+
+        try:
+            os.rename( tmp_dir, extract_dir )
+        except OSError:
+            # A concurrent run has renamed its tree into place first.
+            if not is_current( extract_dir, path_to_fmu ):
+                raise
+    finally:
+        shutil.rmtree( tmp_dir, ignore_errors=True )
+        if old_dir is not None:
+            shutil.rmtree( old_dir, ignore_errors=True )
+
+    return uri_to_extracted_fmu
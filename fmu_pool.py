@@ -0,0 +1,112 @@
+"""
+    Pool of instantiated FMUs, for reusing them in consecutive runs in the same process.
+"""
+
+import collections
+import weakref
+import fmipp
+
+
+class FMUPool(object):
+    """
+        Keeps FMU instances (slaves) alive after a run, so that the next run in the same process (e.g., the
+        next point of a parameter sweep) can reuse them instead of starting the simulation tool again.
+
+        FMI++ provides no way to reset a slave, so a reused slave continues from its current internal time.
+        Together with each idle slave, the pool stores a state (dict) provided by the simulator that released
+        it, e.g., the slave's internal time. The simulator that reuses the slave is responsible for resetting
+        it (inputs, outputs relative to their values at release).
+        Slaves that are not released (e.g., after an error) stop counting towards the pool size as soon
+        as they are garbage collected.
+    """
+
+    def __init__(self):
+        self.idle = collections.defaultdict(list)   # idle slaves and their states, per key
+        self.alive = collections.defaultdict(weakref.WeakSet) # slaves alive (idle or in use), per key
+
+
+    def acquire( self, key, instantiate, max_size ):
+        '''Return an idle slave for the given key as tuple (fmu, state). If there is none, a new slave
+        is created by calling instantiate() and returned with state None. At most *max_size* slaves
+        per key are alive at the same time (e.g., to not exceed the number of available tool licenses).'''
+        if self.idle[key]:
+            return self.idle[key].pop()
+
+        if len( self.alive[key] ) >= max_size:
+            raise RuntimeError( 'FMU pool size exceeded ({0} instances of {1} already in use)'.format(
+                len( self.alive[key] ), key[0] ) )
+
+        fmu = instantiate()
+        self.alive[key].add( fmu )
+        return fmu, None
+
+
+    def release( self, key, fmu, state ):
+        '''Return a slave to the pool for reuse.'''
+        self.idle[key].append( ( fmu, state ) )
+
+
+    def clear( self ):
+        '''Drop all idle slaves (their simulation tools are shut down when they are garbage collected).'''
+        self.idle.clear()
+
+
+# FMU instances kept alive across runs in the same process (used by simulators with parameter pool_size > 0).
+FMU_POOL = FMUPool()
+
+
+class PooledFMUSimulator(object):
+    """
+        Mixin for simulators whose entities are instances of a co-simulation FMU (see TC3PowerSystem
+        and TC3Controller), which creates these instances or takes them from FMU_POOL (with parameter
+        pool_size > 0) and returns them to the pool at the end of the run.
+
+        The simulator has to set the FMU instantiation parameters (uri_to_extracted_fmu, model_name,
+        instance_name, logging_on, time_diff_resolution, timeout, visible, interactive), the time
+        parameters (start_time, stop_time, stop_time_defined, sec_per_mt) and pool_size, and keep its
+        FMUs in _entities and their times in fmutimes and fmu_time_offsets. The state stored with a
+        released FMU contains its internal time and whatever get_pool_state() returns.
+    """
+
+    def acquire_fmu(self):
+        '''Return an FMU instance as tuple (fmu, state), where state is None for a new instance
+        and the state stored at its release for a reused instance.'''
+        if self.pool_size > 0:
+            return FMU_POOL.acquire( self.get_pool_key(), self.instantiate_fmu, self.pool_size )
+        return ( self.instantiate_fmu(), None )
+
+
+    def release_fmus(self):
+        '''Return the FMUs of all entities to the pool (if enabled).'''
+        if self.pool_size > 0:
+            for eid, fmu in self._entities.items():
+                state = dict( self.get_pool_state( eid ), time=self.fmutimes[eid] + self.fmu_time_offsets[eid] )
+                FMU_POOL.release( self.get_pool_key(), fmu, state )
+            self._entities.clear()
+
+
+    def get_pool_state(self, eid):
+        '''Return the state (dict) stored together with the FMU of an entity when it is released.'''
+        return {}
+
+
+    def instantiate_fmu(self):
+        '''Create, instantiate and initialize a new FMU instance. FMUs that may be reused are
+        initialized without stop time, since the next run continues from their last time.'''
+        fmu = fmipp.FMUCoSimulationV1( self.uri_to_extracted_fmu, self.model_name,
+            self.logging_on, self.time_diff_resolution )
+
+        status = fmu.instantiate( self.instance_name, self.timeout, self.visible, self.interactive )
+        assert status == fmipp.fmiOK
+
+        stop_time_defined = self.stop_time_defined and self.pool_size == 0
+        status = fmu.initialize( self.start_time*self.sec_per_mt, stop_time_defined, self.stop_time*self.sec_per_mt )
+        assert status == fmipp.fmiOK
+
+        return fmu
+
+
+    def get_pool_key(self):
+        '''FMU instances can only be reused by simulators with the same FMU and instantiation parameters.'''
+        return ( self.uri_to_extracted_fmu, self.model_name, self.instance_name, self.logging_on,
+            self.time_diff_resolution, self.timeout, self.visible, self.interactive )
@@ -0,0 +1,94 @@
+"""
+    Bounded table of in-flight messages and delivery latency statistics (compatible with Python 2 and 3).
+"""
+
+import math
+from collections import defaultdict
+
+
+class MessageTable(object):
+    """
+        Ring buffer of the messages in flight, indexed by their (consecutive) message IDs.
+        Messages are removed from the table when they are delivered. If a message has not been delivered
+        by the time its slot is needed again (i.e., *capacity* messages later), it is counted as lost.
+    """
+
+    def __init__( self, capacity=1024 ):
+        self.capacity = capacity
+        self.msg_ids = [ 0 ] * capacity     # ID of the message in each slot (0 = empty)
+        self.channels = [ None ] * capacity # channel (input name) of the message in each slot
+        self.values = [ None ] * capacity   # payload of the message in each slot
+        self.send_times = [ 0. ] * capacity # send time of the message in each slot
+        self.tags = [ None ] * capacity     # additional information about the message in each slot
+        self.n_in_flight = 0
+        self.n_lost = 0
+
+
+    def add( self, msg_id, channel, value, send_time, tag=None ):
+        '''Store a new message.'''
+        slot = msg_id % self.capacity
+        if self.msg_ids[slot] != 0:
+            self.n_lost += 1
+            self.n_in_flight -= 1
+        self.msg_ids[slot] = msg_id
+        self.channels[slot] = channel
+        self.values[slot] = value
+        self.send_times[slot] = send_time
+        self.tags[slot] = tag
+        self.n_in_flight += 1
+
+
+    def pop( self, msg_id ):
+        '''Remove a message and return tuple (channel, value, send_time, tag), or None if the message
+        is not in flight (e.g., because it has already been delivered).'''
+        slot = msg_id % self.capacity
+        if self.msg_ids[slot] != msg_id:
+            return None
+        self.msg_ids[slot] = 0
+        self.n_in_flight -= 1
+        message = ( self.channels[slot], self.values[slot], self.send_times[slot], self.tags[slot] )
+        self.values[slot] = None
+        self.tags[slot] = None
+        return message
+
+
+class LatencyHistogram(object):
+    """
+        Histogram of message latencies with fixed bin width (in seconds), together with count, min, max and mean.
+    """
+
+    def __init__( self, bin_width=1e-3 ):
+        self.bin_width = bin_width
+        self.bins = defaultdict(int)        # number of latencies per bin (index of bin = floor(latency/bin_width))
+        self.count = 0
+        self.total = 0.
+        self.min = None
+        self.max = None
+
+
+    def add( self, latency ):
+        # Small tolerance, so that latencies that are multiples of the bin width do not fall into the bin below.
+        self.bins[ int( math.floor( latency / self.bin_width + 1e-9 ) ) ] += 1
+        self.count += 1
+        self.total += latency
+        self.min = latency if self.min is None else min( self.min, latency )
+        self.max = latency if self.max is None else max( self.max, latency )
+
+
+    def mean( self ):
+        return self.total / self.count if self.count > 0 else None
+
+
+    def get_bins( self ):
+        '''Return a sorted list of tuples (lower bin edge, count).'''
+        return [ ( i*self.bin_width, self.bins[i] ) for i in sorted( self.bins ) ]
+
+
+    def __str__( self ):
+        if self.count == 0:
+            return 'no messages'
+        lines = [ '{0} messages, latency min = {1:.6f} s, mean = {2:.6f} s, max = {3:.6f} s'.format(
+            self.count, self.min, self.mean(), self.max ) ]
+        for ( edge, count ) in self.get_bins():
+            lines.append( '  [{0:.6f}, {1:.6f}) s: {2}'.format( edge, edge + self.bin_width, count ) )
+        return '\n'.join( lines )
@@ -1,6 +1,7 @@
 import mosaik_api
 from itertools import count
 import math
+import numpy as np
 
 META = {
     'models': {
@@ -14,21 +15,32 @@ META = {
 
 
 class RampLoadSim:
-    def __init__(self, Llow, Lhigh, ramp_time):
-        self.Llow = Llow
-        self.Lhigh = Lhigh
-        self.ramp_time = ramp_time
-        self.calc_load(0)
+    '''Linearly ramping loads. The loads of all entities are stored in arrays and updated at once.'''
+    def __init__(self):
+        self.Llow = np.zeros(0)
+        self.Lhigh = np.zeros(0)
+        self.ramp_time = np.zeros(0)
+        self.load = np.zeros(0)
+
+    def add_load(self, Llow, Lhigh, ramp_time):
+        '''Add a load and return its index.'''
+        self.Llow = np.append(self.Llow, Llow)
+        self.Lhigh = np.append(self.Lhigh, Lhigh)
+        self.ramp_time = np.append(self.ramp_time, ramp_time)
+        self.load = np.append(self.load, self.ramp(0, Llow, Lhigh, ramp_time))
+        return len(self.load) - 1
+
+    @staticmethod
+    def ramp(t, Llow, Lhigh, ramp_time):
+        ramping = np.logical_and(t <= ramp_time, ramp_time > 0)
+        delta = 1 - ( ramp_time - t ) / np.where(ramping, ramp_time, 1.)
+        return np.where(ramping, Llow + ( Lhigh - Llow ) * delta, Lhigh)
 
     def calc_load(self, t):
-        if t > self.ramp_time:
-            self.load = self.Lhigh
-        else:
-            delta = 1 - ( self.ramp_time - t ) / self.ramp_time
-            self.load = self.Llow + ( self.Lhigh - self.Llow ) * delta
+        self.load = self.ramp(t, self.Llow, self.Lhigh, self.ramp_time)
 
-    def get_load(self):
-        return self.load
+    def get_load(self, i):
+        return float(self.load[i])
 
 
 class RampingLoad(mosaik_api.Simulator):
@@ -37,7 +49,8 @@ class RampingLoad(mosaik_api.Simulator):
 
         # Per-entity dicts
         self.eid_counters = {}
-        self.simulators = {}
+        self.load_index = {}
+        self.loads = RampLoadSim()
         self.return_data = False
 
     def init(self, sid, step_size=5, eid_prefix="RampingLoad"):
@@ -53,8 +66,7 @@ class RampingLoad(mosaik_api.Simulator):
         for _ in range(num):
             eid = '%s_%s' % (self.eid_prefix, next(counter))
 
-            esim = RampLoadSim(Llow, Lhigh, ramp_time)
-            self.simulators[eid] = esim
+            self.load_index[eid] = self.loads.add_load(Llow, Lhigh, ramp_time)
 
             entities.append({'eid': eid, 'type': model})
 
@@ -67,23 +79,24 @@ class RampingLoad(mosaik_api.Simulator):
     def step(self, time, inputs):
 
         if 0 == math.fmod( time, self.step_size ):
-            for eid, esim in self.simulators.items():
-                esim.calc_load(time)
+            self.loads.calc_load(time)
             self.return_data = True
+            # Loads are only published for one time step.
+            return time + 1
         else:
             self.return_data = False
-
-        return time + 1 # self.step_size
+            # Nothing to do until the next publishing time.
+            return int( math.ceil( ( time // self.step_size + 1 ) * self.step_size ) )
 
     def get_data(self, outputs):
         data = {}
 
-        for eid, esim in self.simulators.items():
+        for eid, i in self.load_index.items():
             requests = outputs.get(eid, [])
             mydata = {}
             for attr in requests:
                 if attr == 'L':
-                    mydata[attr] = esim.get_load() if self.return_data is True else None
+                    mydata[attr] = self.loads.get_load(i) if self.return_data is True else None
                 else:
                     raise RuntimeError("RampingLoad {0} has no attribute {1}.".format(eid, attr))
             data[eid] = mydata
@@ -0,0 +1,126 @@
+"""
+    Content-addressed cache for results of scenario runs.
+    Results are stored under a hash of everything that determines them, so that identical runs can be skipped.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time as timer
+
+
+# Digests of files already hashed by this process, keyed by (path, size, mtime).
+digest_memo = {}
+
+def file_digest( path, block_size=1<<20 ):
+    '''Return the SHA-256 digest of a file, or None if the file does not exist.'''
+    if not os.path.isfile( path ):
+        return None
+
+    stat = os.stat( path )
+    memo_key = ( os.path.abspath( path ), stat.st_size, stat.st_mtime )
+    if memo_key in digest_memo:
+        return digest_memo[memo_key]
+
+    sha = hashlib.sha256()
+    with open( path, 'rb' ) as f:
+        for block in iter( lambda: f.read( block_size ), b'' ):
+            sha.update( block )
+
+    digest_memo[memo_key] = sha.hexdigest()
+    return digest_memo[memo_key]
+
+
+class ResultCache(object):
+    """
+        Stores result files in a cache directory, named after the hash of the run's parameters.
+        Optionally, the cache is kept bounded by evicting entries older than *max_age* seconds
+        and, least recently used first, entries exceeding a total size of *max_size* bytes.
+    """
+
+    suffix = '.h5'
+
+    def __init__( self, cache_dir, max_size=None, max_age=None ):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_age = max_age
+
+        if not os.path.isdir( self.cache_dir ):
+            os.makedirs( self.cache_dir, exist_ok=True )
+
+
+    def key( self, params ):
+        '''Return the cache key of a run, given a JSON-serializable dict of everything that determines its result.'''
+        return hashlib.sha256( json.dumps( params, sort_keys=True ).encode( 'utf-8' ) ).hexdigest()
+
+
+    def path( self, key ):
+        return os.path.join( self.cache_dir, key + self.suffix )
+
+
+    def get( self, key, output_file ):
+        '''Copy the cached result to output_file. Returns False if there is no cached result.'''
+        path = self.path( key )
+        try:
+            shutil.copyfile( path, output_file )
+            os.utime( path ) # Mark as recently used.
+        except FileNotFoundError:
+            return False
+        return True
+
+
+    def put( self, key, output_file ):
+        '''Store a result in the cache. The file is copied to a temporary file first and then renamed,
+        so that concurrent runs never see a partially written entry.'''
+        fd, tmp_path = tempfile.mkstemp( dir=self.cache_dir, suffix='.tmp' )
+        os.close( fd )
+        try:
+            shutil.copyfile( output_file, tmp_path )
+            os.replace( tmp_path, self.path( key ) )
+        except:
+            os.remove( tmp_path )
+            raise
+
+
+    def entries( self ):
+        '''Return a list of (path, size, mtime) of all cache entries.'''
+        entries = []
+        for name in os.listdir( self.cache_dir ):
+            if not name.endswith( self.suffix ): continue
+            path = os.path.join( self.cache_dir, name )
+            try:
+                stat = os.stat( path )
+            except FileNotFoundError: # Removed by a concurrent run.
+                continue
+            entries.append( ( path, stat.st_size, stat.st_mtime ) )
+        return entries
+
+
+    def evict( self ):
+        '''Remove entries that are too old or exceed the size limit (least recently used first).'''
+        entries = sorted( self.entries(), key=lambda entry: entry[2], reverse=True )
+
+        if self.max_age is not None:
+            now = timer.time()
+            expired = [ entry for entry in entries if now - entry[2] > self.max_age ]
+            entries = [ entry for entry in entries if now - entry[2] <= self.max_age ]
+        else:
+            expired = []
+
+        if self.max_size is not None:
+            total_size = 0
+            for i, ( _, size, _ ) in enumerate( entries ):
+                total_size += size
+                if total_size > self.max_size:
+                    expired += entries[i:]
+                    break
+
+        for path, _, _ in expired:
+            try:
+                os.remove( path )
+            except FileNotFoundError: # Removed by a concurrent run.
+                pass
+
+        return len( expired )
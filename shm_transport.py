@@ -0,0 +1,468 @@
+"""
+    Shared-memory transport for simulators that run in a separate process on the same host (compatible with
+    Python 2 and 3).
+
+    Mosaik talks to simulator ShmSimulatorProxy in its own process, which forwards all calls to the actual
+    simulator (served by serve_shm in the other process) through two single-producer/single-consumer ring
+    buffers in a memory-mapped file, one for requests and one for responses. A peer is notified of a new message
+    only by the ring's head counter (the doorbell), which it polls by spinning briefly, then yielding the CPU
+    and finally sleeping. The counters are updated with single aligned 64-bit stores without memory barriers,
+    which requires a platform with ordered stores (x86, see check_platform).
+    Calls to init, create and setup_done are encoded as JSON. Inputs of step and outputs of get_data are encoded
+    as fixed-size binary records, with entity, attribute and source names replaced by integer IDs (each name
+    is only sent once).
+    While the channel is open, the proxy increments a heartbeat counter in the file header from a background
+    thread. The simulator stops if the counter does not change for HEARTBEAT_TIMEOUT seconds (i.e., mosaik's
+    process has been killed), which works whatever process (e.g., a shell) has started the simulator.
+"""
+
+import ctypes
+import json
+import mmap
+import numbers
+import os
+import platform
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+
+import mosaik_api
+
+
+SHM_MAGIC = b'TC3SHM02'
+
+# File header: magic, flag set when the proxy has finished, then head and tail counters of both rings
+# and the heartbeat counter of the proxy.
+SHM_HEADER = struct.Struct( '<8sQ' )
+RING_HEADER = struct.Struct( '<QQ' )
+RING_HEADER_OFFSETS = [ SHM_HEADER.size, SHM_HEADER.size + RING_HEADER.size ]
+HEARTBEAT_OFFSET = SHM_HEADER.size + 2*RING_HEADER.size
+DATA_OFFSET = 64
+
+# Message types (first byte of each message).
+MSG_JSON = b'J'     # JSON-encoded call [func, args, kwargs] or result
+MSG_STEP = b'S'     # step: time, followed by input records
+MSG_DATA = b'G'     # get_data: output records
+MSG_ERROR = b'E'    # error message of the simulator (UTF-8)
+MSG_STOP = b'X'     # end of the simulation
+
+# Records of step and get_data messages.
+RECORD_NAME = struct.Struct( '<cHH' )       # 'N', name ID, length of UTF-8 name (followed by the name)
+RECORD_VALUE = struct.Struct( '<cHHHc' )    # 'V', entity ID, attribute ID, source ID, value type (followed by the value)
+RECORD_OUTPUT = struct.Struct( '<cHH' )     # 'O', entity ID, attribute ID (requested output)
+TIME = struct.Struct( '<q' )
+INT_VALUE = struct.Struct( '<q' )
+FLOAT_VALUE = struct.Struct( '<d' )
+LENGTH = struct.Struct( '<I' )
+
+NO_SOURCE = 0xFFFF
+
+# Number of polls of a ring before a waiting peer starts to yield the CPU, and time (in seconds)
+# after which it starts to sleep.
+SPIN_COUNT = 100
+YIELD_TIME = 1e-3
+SLEEP_TIME = 1e-4
+
+# Interval (in seconds) between heartbeats of the proxy, and time (in seconds) without heartbeat after which
+# the simulator considers mosaik's process to have exited (long enough for mosaik to be busy, e.g., in an FMU).
+HEARTBEAT_INTERVAL = 0.5
+HEARTBEAT_TIMEOUT = 60.
+
+# Machine types (platform.machine(), lower case) of x86 processors, whose stores are seen in program order.
+X86_MACHINES = [ 'x86_64', 'amd64', 'x86', 'i386', 'i486', 'i586', 'i686' ]
+
+
+def check_platform():
+    '''Raise an error on platforms other than x86, on which the shared-memory transport is not safe.'''
+    if platform.machine().lower() not in X86_MACHINES:
+        raise RuntimeError( 'the shared-memory transport requires an x86 processor (ordered stores), '
+            'not supported on {0}'.format( platform.machine() ) )
+
+
+class ShmRing(object):
+    """
+        Ring buffer of length-prefixed messages in a shared memory map. The head counter (total number of
+        bytes written) is only changed by the producer, the tail counter (total number of bytes read) only
+        by the consumer.
+    """
+
+    def __init__( self, buf, header_offset, data_offset, capacity ):
+        self.buf = buf
+        self.counters = ( ctypes.c_uint64 * 2 ).from_buffer( buf, header_offset ) # head, tail
+        self.data_offset = data_offset
+        self.capacity = capacity
+
+
+    def has_message( self ):
+        return self.counters[0] != self.counters[1]
+
+
+    def write( self, message, wait ):
+        '''Append a message, waiting (with function *wait*) until there is enough space.'''
+        size = LENGTH.size + len( message )
+        if size > self.capacity:
+            raise RuntimeError( 'message of {0} bytes exceeds ring buffer size {1}'.format( len( message ), self.capacity ) )
+
+        wait( lambda: self.capacity - ( self.counters[0] - self.counters[1] ) >= size )
+        head = self.counters[0]
+        self.copy_in( head, LENGTH.pack( len( message ) ) )
+        self.copy_in( head + LENGTH.size, message )
+
+        # Publish the message only after it has been copied.
+        self.counters[0] = head + size
+
+
+    def read( self, wait ):
+        '''Remove and return the next message, waiting (with function *wait*) until there is one.'''
+        wait( self.has_message )
+        tail = self.counters[1]
+        ( length, ) = LENGTH.unpack( self.copy_out( tail, LENGTH.size ) )
+        message = self.copy_out( tail + LENGTH.size, length )
+        self.counters[1] = tail + LENGTH.size + length
+        return message
+
+
+    def copy_in( self, pos, data ):
+        start = pos % self.capacity
+        first = min( len( data ), self.capacity - start )
+        self.buf[ self.data_offset + start : self.data_offset + start + first ] = data[:first]
+        if first < len( data ):
+            self.buf[ self.data_offset : self.data_offset + len( data ) - first ] = data[first:]
+
+
+    def copy_out( self, pos, length ):
+        start = pos % self.capacity
+        first = min( length, self.capacity - start )
+        data = self.buf[ self.data_offset + start : self.data_offset + start + first ]
+        if first < length:
+            data += self.buf[ self.data_offset : self.data_offset + length - first ]
+        return data
+
+
+class ShmChannel(object):
+    """
+        Two rings (requests from the proxy, responses from the simulator) in a memory-mapped file.
+    """
+
+    def __init__( self, filename, ring_size=None ):
+        '''Create the file if *ring_size* is given (proxy), otherwise open an existing file (simulator).'''
+        check_platform()
+        if ring_size is not None:
+            with open( filename, 'wb' ) as f:
+                f.write( SHM_HEADER.pack( SHM_MAGIC, 0 ) )
+                f.write( b'\0' * ( DATA_OFFSET - SHM_HEADER.size + 2*ring_size ) )
+
+        self.file = open( filename, 'r+b' )
+        self.buf = mmap.mmap( self.file.fileno(), 0 )
+        ( magic, _ ) = SHM_HEADER.unpack_from( self.buf, 0 )
+        if magic != SHM_MAGIC:
+            raise RuntimeError( 'not a shared memory file: {0}'.format( filename ) )
+
+        capacity = ( len( self.buf ) - DATA_OFFSET ) // 2
+        self.requests = ShmRing( self.buf, RING_HEADER_OFFSETS[0], DATA_OFFSET, capacity )
+        self.responses = ShmRing( self.buf, RING_HEADER_OFFSETS[1], DATA_OFFSET + capacity, capacity )
+        self.heartbeat = ctypes.c_uint64.from_buffer( self.buf, HEARTBEAT_OFFSET )
+
+
+    def is_closed( self ):
+        return SHM_HEADER.unpack_from( self.buf, 0 )[1] != 0
+
+
+    def beat( self ):
+        '''Increment the heartbeat counter (proxy).'''
+        self.heartbeat.value += 1
+
+
+    def is_alive_monitor( self, timeout=HEARTBEAT_TIMEOUT ):
+        '''Return a function that tells whether the heartbeat counter has changed within the last *timeout*
+        seconds (simulator).'''
+        last = [ self.heartbeat.value, time.time() ]
+        def is_alive():
+            beat = self.heartbeat.value
+            now = time.time()
+            if beat != last[0]:
+                last[:] = [ beat, now ]
+            return now - last[1] < timeout
+        return is_alive
+
+
+    def close( self ):
+        '''Mark the channel as closed (proxy) and release the memory map.'''
+        struct.pack_into( '<Q', self.buf, 8, 1 )
+        self.requests = self.responses = self.heartbeat = None # Release the counters (exported from the memory map).
+        self.buf.close()
+        self.file.close()
+
+
+class ProcessExitedError(RuntimeError):
+    '''The process at the other end of a shared memory channel has exited.'''
+
+
+def wait_until( condition, timeout=None, is_alive=None ):
+    '''Poll *condition* until it is true. After SPIN_COUNT polls, yield the CPU (or sleep) between polls
+    and check that the peer is still alive (function *is_alive*) and the timeout (in seconds) is not exceeded.'''
+    n_polls = 0
+    start = None
+    while not condition():
+        n_polls += 1
+        if n_polls < SPIN_COUNT:
+            continue
+
+        if start is None:
+            start = time.time()
+        waited = time.time() - start
+        if timeout is not None and waited > timeout:
+            raise RuntimeError( 'no response through shared memory within {0} s'.format( timeout ) )
+        if is_alive is not None and n_polls % SPIN_COUNT == 0 and not is_alive():
+            raise ProcessExitedError( 'process at the other end of the shared memory channel has exited' )
+        time.sleep( 0 if waited < YIELD_TIME else SLEEP_TIME )
+
+
+class RecordEncoder(object):
+    """
+        Encodes step inputs and get_data outputs as binary records. Names are replaced by IDs,
+        new names are sent (once) in name records.
+    """
+
+    def __init__(self):
+        self.name_ids = {}
+
+
+    def get_id( self, name, parts ):
+        if name not in self.name_ids:
+            self.name_ids[name] = len( self.name_ids )
+            encoded = name.encode( 'utf-8' )
+            parts.append( RECORD_NAME.pack( b'N', self.name_ids[name], len( encoded ) ) )
+            parts.append( encoded )
+        return self.name_ids[name]
+
+
+    def encode_value( self, eid, attr, src, val, parts ):
+        ids = ( self.get_id( eid, parts ), self.get_id( attr, parts ),
+            NO_SOURCE if src is None else self.get_id( src, parts ) )
+        if val is None:
+            parts.append( RECORD_VALUE.pack( b'V', ids[0], ids[1], ids[2], b'n' ) )
+        elif isinstance( val, numbers.Integral ) and not isinstance( val, bool ):
+            parts.append( RECORD_VALUE.pack( b'V', ids[0], ids[1], ids[2], b'i' ) + INT_VALUE.pack( val ) )
+        elif isinstance( val, numbers.Real ) and not isinstance( val, bool ):
+            parts.append( RECORD_VALUE.pack( b'V', ids[0], ids[1], ids[2], b'f' ) + FLOAT_VALUE.pack( val ) )
+        else:
+            encoded = json.dumps( val ).encode( 'utf-8' )
+            parts.append( RECORD_VALUE.pack( b'V', ids[0], ids[1], ids[2], b'j' ) + LENGTH.pack( len( encoded ) ) + encoded )
+
+
+    def encode_inputs( self, inputs, parts ):
+        '''Encode inputs of step ({eid: {attr: {src: val}}}).'''
+        for eid, attrs in inputs.items():
+            for attr, vals in attrs.items():
+                for src, val in vals.items():
+                    self.encode_value( eid, attr, src, val, parts )
+
+
+    def encode_outputs( self, outputs, parts ):
+        '''Encode requested outputs of get_data ({eid: [attr]}).'''
+        for eid, attrs in outputs.items():
+            for attr in attrs:
+                parts.append( RECORD_OUTPUT.pack( b'O', self.get_id( eid, parts ), self.get_id( attr, parts ) ) )
+
+
+    def encode_data( self, data, parts ):
+        '''Encode the result of get_data ({eid: {attr: val}}).'''
+        for eid, attrs in data.items():
+            for attr, val in attrs.items():
+                self.encode_value( eid, attr, None, val, parts )
+
+
+class RecordDecoder(object):
+    """
+        Decodes the records written by a RecordEncoder.
+    """
+
+    def __init__(self):
+        self.names = []
+
+
+    def decode( self, message, offset ):
+        '''Return a dict with entries {eid: {attr: {src: val}}} (value records with source)
+        or {eid: {attr: val}} (value records without source) or {eid: [attr]} (output records).'''
+        result = {}
+        while offset < len( message ):
+            record_type = message[ offset : offset + 1 ]
+            if record_type == b'N':
+                ( _, name_id, length ) = RECORD_NAME.unpack_from( message, offset )
+                offset += RECORD_NAME.size
+                assert name_id == len( self.names )
+                self.names.append( message[ offset : offset + length ].decode( 'utf-8' ) )
+                offset += length
+            elif record_type == b'O':
+                ( _, eid, attr ) = RECORD_OUTPUT.unpack_from( message, offset )
+                offset += RECORD_OUTPUT.size
+                result.setdefault( self.names[eid], [] ).append( self.names[attr] )
+            elif record_type == b'V':
+                ( _, eid, attr, src, value_type ) = RECORD_VALUE.unpack_from( message, offset )
+                offset += RECORD_VALUE.size
+                if value_type == b'n':
+                    val = None
+                elif value_type == b'i':
+                    ( val, ) = INT_VALUE.unpack_from( message, offset )
+                    offset += INT_VALUE.size
+                elif value_type == b'f':
+                    ( val, ) = FLOAT_VALUE.unpack_from( message, offset )
+                    offset += FLOAT_VALUE.size
+                else:
+                    ( length, ) = LENGTH.unpack_from( message, offset )
+                    offset += LENGTH.size
+                    val = json.loads( message[ offset : offset + length ].decode( 'utf-8' ) )
+                    offset += length
+
+                attrs = result.setdefault( self.names[eid], {} )
+                if src == NO_SOURCE:
+                    attrs[ self.names[attr] ] = val
+                else:
+                    attrs.setdefault( self.names[attr], {} )[ self.names[src] ] = val
+            else:
+                raise RuntimeError( 'invalid record type: {0!r}'.format( record_type ) )
+        return result
+
+
+def encode_json( message_type, content ):
+    return message_type + json.dumps( content ).encode( 'utf-8' )
+
+
+def serve_shm( simulator, filename, heartbeat_timeout=HEARTBEAT_TIMEOUT ):
+    '''Serve the calls of a ShmSimulatorProxy to *simulator* through the shared memory file created by the proxy,
+    until the proxy stops the simulation (or closes the channel), or its heartbeat stops for *heartbeat_timeout*
+    seconds (i.e., mosaik's process has exited).'''
+    channel = ShmChannel( filename )
+    encoder = RecordEncoder()
+    decoder = RecordDecoder()
+    is_alive = channel.is_alive_monitor( heartbeat_timeout )
+    wait = lambda condition: wait_until( lambda: condition() or channel.is_closed(), is_alive=is_alive )
+
+    try:
+        while True:
+            wait( channel.requests.has_message )
+            if channel.is_closed() and not channel.requests.has_message():
+                break
+
+            request = channel.requests.read( wait )
+            try:
+                if request[:1] == MSG_STEP:
+                    ( time, ) = TIME.unpack_from( request, 1 )
+                    next_time = simulator.step( time, decoder.decode( request, 1 + TIME.size ) )
+                    response = MSG_STEP + TIME.pack( -1 if next_time is None else next_time )
+                elif request[:1] == MSG_DATA:
+                    parts = [ MSG_DATA ]
+                    encoder.encode_data( simulator.get_data( decoder.decode( request, 1 ) ), parts )
+                    response = b''.join( parts )
+                elif request[:1] == MSG_JSON:
+                    ( func, args, kwargs ) = json.loads( request[1:].decode( 'utf-8' ) )
+                    kwargs = dict( ( str( k ), v ) for k, v in kwargs.items() )
+                    response = encode_json( MSG_JSON, getattr( simulator, func )( *args, **kwargs ) )
+                else:
+                    break
+            except Exception as e:
+                response = MSG_ERROR + '{0}: {1}'.format( type( e ).__name__, e ).encode( 'utf-8' )
+            channel.responses.write( response, wait )
+    except ProcessExitedError:
+        print( 'no heartbeat from the mosaik process, stopping the simulator' )
+    finally:
+        simulator.finalize()
+
+
+class ShmSimulatorProxy(mosaik_api.Simulator):
+    """
+        Runs in the mosaik process and forwards all calls to a simulator in a separate process, which is
+        started with command *shm_cmd* (tag '{shm}' is replaced by the path to the shared memory file) and
+        serves the calls with serve_shm. All other parameters of init are passed on to the simulator.
+    """
+
+    def __init__(self):
+        super(ShmSimulatorProxy, self).__init__( { 'models': {} } )
+        self.channel = None
+        self.process = None
+        self.encoder = RecordEncoder()
+        self.decoder = RecordDecoder()
+        self.shm_file = None
+        self.timeout = None
+        self.heartbeat = None               # background thread incrementing the heartbeat counter
+        self.stopped = threading.Event()    # set when the heartbeat thread has to stop
+
+
+    def init( self, sid, shm_cmd, shm_cwd=None, shm_file=None, shm_ring_size=1<<20, shm_timeout=60., **sim_params ):
+        if shm_file is None:
+            ( fd, shm_file ) = tempfile.mkstemp( prefix='tc3_shm_' )
+            os.close( fd )
+        self.shm_file = shm_file
+        self.timeout = shm_timeout
+
+        self.channel = ShmChannel( shm_file, shm_ring_size )
+        self.heartbeat = threading.Thread( target=self.beat )
+        self.heartbeat.daemon = True
+        self.heartbeat.start()
+
+        # Forward slashes work on Windows and survive shells (e.g., Cygwin's bash).
+        self.process = subprocess.Popen( shm_cmd.format( shm=shm_file.replace( '\\', '/' ) ), cwd=shm_cwd, shell=True )
+
+        meta = self.call( 'init', sid, **sim_params )
+        self.meta.update( ( key, val ) for key, val in meta.items() if key != 'api_version' )
+        return self.meta
+
+
+    def create( self, num, model, **model_params ):
+        return self.call( 'create', num, model, **model_params )
+
+
+    def setup_done( self ):
+        return self.call( 'setup_done' )
+
+
+    def step( self, time, inputs ):
+        parts = [ MSG_STEP, TIME.pack( time ) ]
+        self.encoder.encode_inputs( inputs, parts )
+        response = self.request( b''.join( parts ) )
+        ( next_time, ) = TIME.unpack_from( response, 1 )
+        return None if next_time < 0 else next_time
+
+
+    def get_data( self, outputs ):
+        parts = [ MSG_DATA ]
+        self.encoder.encode_outputs( outputs, parts )
+        return self.decoder.decode( self.request( b''.join( parts ) ), 1 )
+
+
+    def finalize( self ):
+        if self.channel is None:
+            return
+        self.channel.requests.write( MSG_STOP, self.wait )
+        self.stopped.set()
+        self.heartbeat.join()
+        self.channel.close()
+        self.channel = None
+        self.process.wait()
+        os.remove( self.shm_file )
+
+
+    def call( self, func, *args, **kwargs ):
+        return json.loads( self.request( encode_json( MSG_JSON, [ func, args, kwargs ] ) )[1:].decode( 'utf-8' ) )
+
+
+    def request( self, message ):
+        '''Send a request to the simulator and return its response.'''
+        self.channel.requests.write( message, self.wait )
+        response = self.channel.responses.read( self.wait )
+        if response[:1] == MSG_ERROR:
+            raise RuntimeError( 'error in simulator process: {0}'.format( response[1:].decode( 'utf-8' ) ) )
+        return response
+
+
+    def beat( self ):
+        '''Increment the heartbeat counter every HEARTBEAT_INTERVAL seconds, until the proxy is finalized.'''
+        while not self.stopped.wait( HEARTBEAT_INTERVAL ):
+            self.channel.beat()
+
+
+    def wait( self, condition ):
+        wait_until( condition, self.timeout, lambda: self.process.poll() is None )
@@ -4,6 +4,8 @@
 """
 
 import collections
+import heapq
+import math
 import mosaik_api
 from itertools import count
 
@@ -31,12 +33,17 @@ class TapActuator(mosaik_api.Simulator):
         self.wakeup_time = {}               # time stamp until end of dead time
         self.dead_time = {}                 # dead time of controller
         self.tap_position = {}                 # dead time of controller
+        self.event_driven = False           # only step when needed instead of at every mosaik time step
+        self.wakeup_queue = []              # heap of (wakeup time, eid) of actuators in dead time
+        self.actuated = []                  # actuators that actuated a tap position in the previous step
+        self.n_responsive = 0               # number of actuators that are responsive
         self.verbose = False
 
 
-    def init( self, sid, seconds_per_mosaik_timestep=1, verbose=False ):
+    def init( self, sid, seconds_per_mosaik_timestep=1, event_driven=False, verbose=False ):
 
         self.sec_per_mt = seconds_per_mosaik_timestep # Number of seconds of internaltime per mosaiktime (Default: 1, mosaiktime measured in seconds)
+        self.event_driven = event_driven
         self.verbose = verbose
 
         return self.meta
@@ -54,6 +61,8 @@ class TapActuator(mosaik_api.Simulator):
             self.dead_time[eid] = dead_time
             self.is_responsive[eid] = True
             self.wakeup_time[eid] = None
+            self.n_responsive += 1
+            self.actuated.append( eid ) # Initial tap position is only output before the first step.
 
             entities.append( { 'eid': eid, 'type': model, 'rel': [] } )
 
@@ -63,6 +72,9 @@ class TapActuator(mosaik_api.Simulator):
     def step(self, time, inputs):
         #print( 'TAP ACTUATOR called at t = {}, inputs = {}'.format( time, inputs ) )
 
+        if self.event_driven is True:
+            return self.step_event_driven(time, inputs)
+
         for eid, edata in self.data.items():
             input_data = inputs.get(eid, {})
 
@@ -89,6 +101,53 @@ class TapActuator(mosaik_api.Simulator):
         return time + 1
 
 
+    def step_event_driven(self, time, inputs):
+        '''Same behavior as step(), but only touches actuators with new setpoints or an expiring dead time.
+        Mosaik only provides inputs when the simulator steps, so the actuator has to step at every time step
+        as long as any actuator is responsive. When all actuators are in dead time, the next step is at the
+        earliest end of a dead time.'''
+
+        # Actuated tap positions are only output for one time step.
+        for eid in self.actuated:
+            self.data[eid]['tap_position'] = None
+        self.actuated = []
+
+        # Actuators whose dead time ends now (they ignore setpoints received in this step).
+        woken = []
+        while self.wakeup_queue and time >= self.wakeup_queue[0][0]:
+            woken.append( heapq.heappop( self.wakeup_queue )[1] )
+
+        for eid, input_data in inputs.items():
+            if 'tap_setpoint' not in input_data or self.is_responsive[eid] is not True:
+                continue
+
+            [ ( _, tap_setpoint ) ] = input_data['tap_setpoint'].items()
+            if tap_setpoint is not None:
+                self.tap_position[eid] = tap_setpoint
+                if self.verbose: print( "Received new tap position {} at time {}".format( tap_setpoint, time ) )
+
+                # Enter dead time.
+                self.is_responsive[eid] = False
+                self.wakeup_time[eid] = time + self.dead_time[eid]
+                heapq.heappush( self.wakeup_queue, ( self.wakeup_time[eid], eid ) )
+                self.n_responsive -= 1
+
+        for eid in woken:
+            self.wakeup_time[eid] = None
+            self.is_responsive[eid] = True
+            self.n_responsive += 1
+
+            self.data[eid]['tap_position'] = self.tap_position[eid]
+            self.actuated.append( eid )
+            if self.verbose: print( "Actuate tap position {} at time {}".format( self.tap_position[eid], time ) )
+
+        if self.n_responsive > 0 or not self.wakeup_queue:
+            return time + 1
+
+        # All actuators are in dead time, wake up when the first one becomes responsive again.
+        return max( time + 1, int( math.ceil( self.wakeup_queue[0][0] ) ) )
+
+
     def get_data(self, outputs):
         data = {}
         for eid, edata in self.data.items():
@@ -2,6 +2,7 @@ import matplotlib.pyplot as plt
 #import matplotlib.dates as mdates
 import pandas as pd
 import sys
+from collector import read_results, result_columns
 # import seaborn as sns
 
 import warnings
@@ -16,11 +17,9 @@ else:
 
 
 
-store = pd.HDFStore(storename)
-df = store['Monitor']
-store.close()
-df2 = df.to_frame(False).unstack().dropna(axis=1)
-df2.columns = df2.columns.map('.'.join)
+# Load only the columns needed for the plots.
+columns = [c for c in result_columns(storename, 'Monitor') if '.U' in c or 'rampload' in c or '.current_tap' in c]
+df2 = read_results(storename, 'Monitor', columns=columns)
 df2.index.name = ""
 df2 = df2.rename(columns=lambda x: '.'.join(x.split('.')[1:]))
 
@@ -0,0 +1,333 @@
+"""
+    Simulate the communication network with an in-process discrete-event simulation, as an alternative to the ns-3 FMU.
+
+    Messages are delivered by a heap-based event queue, their delays (and losses) are drawn from a delay model
+    per channel (see DELAY_MODELS). The simulator has the same attributes as the ns-3 based TC3CommNetwork
+    (see tc3_comm_ns3_fmu.py), but runs in the same process as mosaik (also on Linux).
+    With delay model TraceDelay, the delays recorded in a trace of the ns-3 based simulator are replayed.
+"""
+
+import mosaik_api
+from itertools import count
+import abc
+import heapq
+import random
+import numpy as np
+
+from message_table import LatencyHistogram
+from comm_trace import read_trace, TRACE_CHANNELS
+
+
+META = {
+    'models': {
+        'TC3CommNetwork': {
+            'public': True,
+            'params': [],
+            'attrs': [
+                'u3_send',
+                'u4_send',
+                'ctrl_send',
+                'u3_receive',
+                'u4_receive',
+                'ctrl_receive',
+                'u3_latency',
+                'u4_latency',
+                'ctrl_latency',
+                'current_time'
+            ],
+        }
+    }
+}
+
+
+# Communication channels (messages sent via attribute <channel>_send are received via <channel>_receive).
+CHANNELS = [ 'u3', 'u4', 'ctrl' ]
+
+# Default delay models: fixed delays (in seconds), corresponding to the delay of the CSMA link in the ns-3 model.
+DEFAULT_DELAY_MODELS = {
+    'u3': { 'model': 'fixed', 'delay': 0.01 },
+    'u4': { 'model': 'fixed', 'delay': 0.01 },
+    'ctrl': { 'model': 'fixed', 'delay': 0.01 },
+}
+
+
+class DelayModel(abc.ABC):
+    """
+        Base class for delay models. With probability *loss*, a message is lost.
+    """
+
+    def __init__( self, loss=0. ):
+        self.loss = loss
+
+
+    def sample( self, rng, send_time ):
+        '''Return the delay of a message sent at send_time (in seconds), or None if the message is lost.'''
+        if self.loss > 0 and rng.random() < self.loss:
+            return None
+        return self.get_delay( rng, send_time )
+
+
+    @abc.abstractmethod
+    def get_delay( self, rng, send_time ):
+        '''Return the delay of a message sent at send_time (in seconds).'''
+
+
+class FixedDelay(DelayModel):
+    """
+        All messages have the same delay.
+    """
+
+    def __init__( self, delay, loss=0. ):
+        super().__init__( loss )
+        self.delay = delay
+
+
+    def get_delay( self, rng, send_time ):
+        return self.delay
+
+
+class EmpiricalDelay(DelayModel):
+    """
+        Delays are drawn from a list of observed delays (e.g., from ns-3 simulations or measurements).
+    """
+
+    def __init__( self, delays, loss=0. ):
+        super().__init__( loss )
+        if len( delays ) == 0:
+            raise RuntimeError( 'empirical delay model needs at least one delay' )
+        self.delays = list( delays )
+
+
+    def get_delay( self, rng, send_time ):
+        return rng.choice( self.delays )
+
+
+class RandomDelay(DelayModel):
+    """
+        Delays are drawn from a distribution of Python's random module (e.g., 'uniform', 'expovariate',
+        'gauss', 'lognormvariate') with the given parameters, shifted by *offset* and limited to non-negative values.
+    """
+
+    def __init__( self, distribution, params, offset=0., loss=0. ):
+        super().__init__( loss )
+        if not hasattr( random.Random, distribution ):
+            raise RuntimeError( 'unknown distribution: {0}'.format( distribution ) )
+        self.distribution = distribution
+        self.params = list( params )
+        self.offset = offset
+
+
+    def get_delay( self, rng, send_time ):
+        return max( 0., self.offset + getattr( rng, self.distribution )( *self.params ) )
+
+
+class TraceDelay(DelayModel):
+    """
+        Delays are replayed from a trace of the ns-3 based simulator (see comm_trace.py), using the messages of
+        one channel (and random seed, if given). For send times not in the trace, the delay is either linearly
+        interpolated between the delays of the messages sent before and after (mode 'interpolate') or drawn
+        from all delays of the channel in the trace (mode 'resample').
+    """
+
+    def __init__( self, trace_file, channel, seed=None, mode='interpolate', time_resolution=1e-9, loss=0. ):
+        super().__init__( loss )
+        if mode not in [ 'interpolate', 'resample' ]:
+            raise RuntimeError( 'unknown mode: {0}'.format( mode ) )
+        self.mode = mode
+        self.time_resolution = time_resolution
+
+        records = read_trace( trace_file )
+        selected = select_trace_records( records, channel, seed )
+        if not selected.any():
+            raise RuntimeError( 'no messages of channel {0} (seed {1}) in trace {2}'.format( channel, seed, trace_file ) )
+
+        order = np.argsort( records['send_time'][selected], kind='stable' )
+        self.send_times = np.asarray( records['send_time'][selected] )[order]
+        self.delays = np.asarray( records['delivery_time'][selected] - records['send_time'][selected] )[order]
+
+
+    def get_delay( self, rng, send_time ):
+        i = np.searchsorted( self.send_times, send_time - self.time_resolution )
+        if i < len( self.send_times ) and self.send_times[i] <= send_time + self.time_resolution:
+            return float( self.delays[i] ) # Send time is in the trace.
+
+        if self.mode == 'interpolate':
+            return float( np.interp( send_time, self.send_times, self.delays ) )
+        return float( self.delays[ rng.randrange( len( self.delays ) ) ] )
+
+
+def select_trace_records( records, channel, seed=None ):
+    '''Return a mask of the trace records of a channel (and random seed, if given).'''
+    selected = records['channel'] == TRACE_CHANNELS.index( channel )
+    if seed is not None:
+        selected &= records['seed'] == seed
+    return selected
+
+
+# Delay models that can be specified by name (see create_delay_model).
+DELAY_MODELS = {
+    'fixed': FixedDelay,
+    'empirical': EmpiricalDelay,
+    'random': RandomDelay,
+    'trace': TraceDelay,
+}
+
+
+def create_delay_model( spec, channel ):
+    '''Create a delay model from a dict with the name of the model (key 'model') and its parameters, e.g.,
+    { 'model': 'random', 'distribution': 'uniform', 'params': [ 0.005, 0.02 ], 'loss': 0.01 }.
+    Instances of DelayModel are returned as they are. If a trace contains messages of the random seed, but
+    none of the channel (e.g., none were delivered in the recorded run), the default delay model of the channel
+    is used. A trace without any message of the random seed is an error (e.g., wrong seed or trace file).'''
+    if isinstance( spec, DelayModel ):
+        return spec
+
+    params = dict( spec )
+    name = params.pop( 'model' )
+    if name not in DELAY_MODELS:
+        raise RuntimeError( 'unknown delay model: {0} (available: {1})'.format( name, sorted( DELAY_MODELS ) ) )
+    if name == 'trace':
+        params.setdefault( 'channel', channel )
+        records = read_trace( params['trace_file'] )
+        if len( records ) == 0 or ( params.get( 'seed' ) is not None and not ( records['seed'] == params['seed'] ).any() ):
+            raise RuntimeError( 'no messages of seed {0} in trace {1}'.format( params.get( 'seed' ), params['trace_file'] ) )
+        if not select_trace_records( records, params['channel'], params.get( 'seed' ) ).any():
+            print( 'WARNING: no messages of channel {0} in trace {1}, using the default delay model {2}'.format(
+                params['channel'], params['trace_file'], DEFAULT_DELAY_MODELS[channel] ) )
+            return create_delay_model( DEFAULT_DELAY_MODELS[channel], channel )
+    return DELAY_MODELS[name]( **params )
+
+
+
+class TC3CommNetwork(mosaik_api.Simulator):
+
+    def __init__(self):
+        super().__init__(META)
+        self.eid_counters = {}
+        self.start_time = 0
+        self.sec_per_mt = 1                 # Number of seconds of internaltime per mosaiktime
+        self.random_seed = 1                # random generator seed
+        self.delay_models = {}              # delay model per channel
+        self.latency_bin_width = 1e-3       # Bin width of latency histograms (in seconds)
+        self.time_diff_resolution = 1e-9    # How close should two events be to be considered equal?
+        self.current_time = 0
+        self.rngs = {}                      # random generators per entity and channel
+        self.queues = {}                    # event queues (heaps of messages in flight) per entity
+        self.msgcounters = {}               # message counters per entity (for ordering messages with equal delivery times)
+        self.outqueue = {}                  # messages delivered in the current step
+        self.outlatency = {}                # latencies of the messages in the output queue
+        self.latencies = {}                 # latency histograms per entity and channel
+        self.n_lost = {}                    # number of lost messages per entity and channel
+        self.verbose = False
+
+
+    def init( self, sid, start_time=0, seconds_per_mosaik_timestep=1, random_seed=1, delay_models=None,
+        latency_bin_width=1e-3, time_diff_resolution=1e-9, verbose=False ):
+
+        self.start_time = start_time
+        self.sec_per_mt = seconds_per_mosaik_timestep
+        self.random_seed = random_seed
+        self.latency_bin_width = latency_bin_width
+        self.time_diff_resolution = time_diff_resolution
+        self.verbose = verbose
+
+        delay_models = dict( DEFAULT_DELAY_MODELS, **( delay_models or {} ) )
+        unknown = set( delay_models ) - set( CHANNELS )
+        if unknown:
+            raise RuntimeError( 'Unknown channels: {0}'.format( sorted( unknown ) ) )
+        self.delay_models = { channel: create_delay_model( spec, channel ) for channel, spec in delay_models.items() }
+
+        return self.meta
+
+
+    def create(self, num, model):
+        counter = self.eid_counters.setdefault(model, count())
+
+        entities = []
+
+        for i in range(num):
+            eid = '%s_%s' % (model, next(counter))  # entity ID
+
+            # Each entity and channel has its own random generator, so that the delays of a channel
+            # do not depend on the traffic of other channels.
+            self.rngs[eid] = { channel: random.Random( '{0}:{1}:{2}'.format( self.random_seed, eid, channel ) )
+                for channel in CHANNELS }
+
+            self.queues[eid] = []
+            self.msgcounters[eid] = count()
+            self.outqueue[eid] = {}
+            self.outlatency[eid] = {}
+            self.latencies[eid] = { channel: LatencyHistogram( self.latency_bin_width ) for channel in CHANNELS }
+            self.n_lost[eid] = dict.fromkeys( CHANNELS, 0 )
+
+            entities.append( { 'eid': eid, 'type': model, 'rel': [] } )
+
+        return entities
+
+
+    def step(self, time, inputs):
+
+        # This is the internal time.
+        target_time = ( time + self.start_time )*self.sec_per_mt
+
+        for eid, queue in self.queues.items():
+            self.outqueue[eid] = {}
+            self.outlatency[eid] = {}
+
+            # Deliver all messages up to the target time (messages delivered at the same time
+            # on the same channel overwrite each other, like in the ns-3 based simulator).
+            while queue and queue[0][0] < target_time + self.time_diff_resolution:
+                ( delivery_time, _, channel, val, send_time ) = heapq.heappop( queue )
+                self.outqueue[eid][channel] = val
+                self.outlatency[eid][channel] = delivery_time - send_time
+                self.latencies[eid][channel].add( delivery_time - send_time )
+                if self.verbose: print( 'OUTPUT MESSAGE: {} from {}, latency = {}'.format( val, channel, delivery_time - send_time ) )
+
+            # Send new messages.
+            for attr, vals in inputs.get( eid, {} ).items():
+                channel = attr.replace( '_send', '' )
+                for source, val in vals.items():
+                    if val is None: continue
+
+                    delay = self.delay_models[channel].sample( self.rngs[eid][channel], target_time )
+                    if delay is None:
+                        self.n_lost[eid][channel] += 1
+                        if self.verbose: print( 'LOST MESSAGE: {} from {}'.format( val, channel ) )
+                        continue
+
+                    heapq.heappush( queue, ( target_time + delay, next( self.msgcounters[eid] ), channel, val, target_time ) )
+                    if self.verbose: print( 'INPUT MESSAGE: {} from {}, delay = {}'.format( val, channel, delay ) )
+
+        self.current_time = time
+
+        # Mosaik only provides inputs when the simulator steps, so it has to step at every time step.
+        return time + 1
+
+
+    def get_data(self, outputs):
+        data = {}
+        for eid, attrs in outputs.items():
+            data[eid] = {}
+            for attr in attrs:
+                if attr == 'current_time':
+                    data[eid][attr] = self.current_time
+                elif attr.endswith( '_latency' ):
+                    data[eid][attr] = self.outlatency[eid].get( attr.replace( '_latency', '' ) )
+                elif attr.endswith( '_receive' ):
+                    data[eid][attr] = self.outqueue[eid].get( attr.replace( '_receive', '' ) )
+                else:
+                    raise RuntimeError("TC3CommNetwork has no output attribute {0}".format(attr))
+        return data
+
+
+    def finalize(self):
+        '''Print the latency histograms of all channels.'''
+        for eid, histograms in self.latencies.items():
+            for channel in CHANNELS:
+                print( '{0} - latency of channel {1}: {2}'.format( eid, channel, histograms[channel] ) )
+            print( '{0} - messages not delivered: {1} lost, {2} in flight'.format(
+                eid, sum( self.n_lost[eid].values() ), len( self.queues[eid] ) ) )
+
+
+if __name__ == '__main__':
+    mosaik_api.start_simulation(TC3CommNetwork())
@@ -1,13 +1,21 @@
+import gc
 import itertools
 import os
+import sys
 import mosaik_api
 
 from fmi_cs_v1_standalone.FMUCoSimulationV1 import *
 from fmi_cs_v1_standalone.extractFMU import *
 import fmi_cs_v1_standalone.parse_xml
+from fmu_extraction import extract_fmu, read_stamp
+from message_table import MessageTable, LatencyHistogram
+from comm_trace import TraceWriter
+from shm_transport import serve_shm
+from entity_stepper import EntityStepper
 
 from math import ceil
 from collections import defaultdict
+import heapq
 
 META = {
     'models': {
@@ -21,6 +29,9 @@ META = {
                 'u3_receive',
                 'u4_receive',
                 'ctrl_receive',
+                'u3_latency',
+                'u4_latency',
+                'ctrl_latency',
                 'current_time'
             ],
         }
@@ -28,6 +39,11 @@ META = {
 }
 
 
+# End-to-end delays of messages (in seconds), keyed by FMU (path and digest), random seed, set of channels sending at
+# the same time and channel of the message. These are kept at module level, so that consecutive runs
+# in the same process can reuse them.
+DELAY_CACHE = {}
+
 
 class TC3CommNetwork(mosaik_api.Simulator):
     """
@@ -60,10 +76,25 @@ class TC3CommNetwork(mosaik_api.Simulator):
         self.event_var_name = False         # Name of the FMU's variable that gives the timing of the next event
         self.default_event_step_size = 0,   # Time between 'default events' (0 = no default events)
         self.random_seed = 1,               # ns-3 random generator seed
-        self.msgtable = {}                  # Tables of messages for translation
+        self.msgtable = {}                  # Tables of messages in flight for translation (see message_table.MessageTable)
         self.msgcounters = {}               # Set of counters for message ID translation
+        self.msg_table_size = 1024          # Max. number of messages in flight per entity
         self.outqueue = {}                  # Holds lists of outputs for various simulators
+        self.outlatency = {}                # Latencies of the messages in the output queue
+        self.latencies = {}                 # Latency histograms per entity and channel
+        self.latency_bin_width = 1e-3       # Bin width of latency histograms (in seconds)
+        self.output_names = []              # Names of the FMU's message outputs (without the event variable)
+        self.drain_var_names = []           # FMU outputs read in one batch after each event (message outputs and event variable)
         self.sec_per_mt = 1                 # Number of seconds of internaltime per mosaiktime
+        self.delay_cache = False            # Deliver messages with known delays without the FMU (see DELAY_CACHE)
+        self.fmu_digest = None              # Digest of the FMU file (part of the keys of DELAY_CACHE)
+        self.localqueue = {}                # Messages delivered without the FMU (heaps of messages in flight)
+        self.delay_cache_hits = 0
+        self.delay_cache_misses = 0
+        self.trace = None                   # Trace of delivered messages (see comm_trace.TraceWriter)
+        self.trace_records = {}             # Messages delivered by each entity in the current step (written to the trace after the step)
+        self.learned_delays = {}            # Delays learned by each entity in the current step (added to DELAY_CACHE after the step)
+        self.stepper = None                 # Steps the entities one after the other or on a thread pool (see entity_stepper.EntityStepper)
         self.verbose = False
 
 
@@ -71,7 +102,8 @@ class TC3CommNetwork(mosaik_api.Simulator):
               start_time=0, stop_time=0, stop_time_defined=False, seconds_per_mosaik_timestep=1,
               time_diff_resolution=1e-9, logging_on=False, interactive=False, visible=False,
               event_var_name='next_event_time', default_event_step_size=0, random_seed=1,
-              var_table=None, translation_table=None, path_conversion=None, verbose=False
+              var_table=None, translation_table=None, path_conversion=None,
+              msg_table_size=1024, latency_bin_width=1e-3, delay_cache=False, trace_file=None, n_threads=0, verbose=False
               ):
         '''Function that allows mosaik to initialize the simulator. Extract the FMU and construct meta description
         for mosaik.'''
@@ -85,6 +117,8 @@ class TC3CommNetwork(mosaik_api.Simulator):
             work_dir = Cygpath().win2posix( work_dir )
             if verbose is True:
                 print( 'Converted working directory to Cygwin path: {}'.format( work_dir ) )
+            if trace_file is not None:
+                trace_file = Cygpath().win2posix( trace_file )
 
         self.work_dir = work_dir
         self.model_name = model_name
@@ -100,18 +134,30 @@ class TC3CommNetwork(mosaik_api.Simulator):
         self.event_var_name = event_var_name
         self.default_event_step_size = default_event_step_size
         self.random_seed = random_seed
+        self.msg_table_size = msg_table_size
+        self.latency_bin_width = latency_bin_width
+        self.delay_cache = delay_cache
+        self.stepper = EntityStepper( n_threads )
         self.verbose = verbose
 
+        if trace_file is not None:
+            self.trace = TraceWriter( trace_file )
+
         path_to_fmu = os.path.join(self.work_dir, self.model_name + '.fmu')
         if self.verbose: print('Attempted to extract FMU {0}, Path {1}'.format(path_to_fmu, self.work_dir))
 
-        self.uri_to_extracted_fmu = extractFMU(
+        self.uri_to_extracted_fmu = extract_fmu(
             path_to_fmu,
             self.work_dir,
-            command = 'unzip -q -o {fmu} -d {dir}'
+            command = 'unzip -q -o {fmu} -d {dir}',
+            verbose = self.verbose
             )
         assert self.uri_to_extracted_fmu is not None
 
+        # The stamp of the extracted tree holds the digest of the FMU it was extracted from, so that a
+        # rebuilt FMU does not reuse delays learned from the old one (e.g., in a long-lived worker).
+        self.fmu_digest = read_stamp( os.path.join( self.work_dir, self.model_name ) )['digest']
+
         '''If no variable table is given by user, parse the modelDescription.xml for a table -
         however, this will not work properly for some FMUs due to varying conventions.'''
         xmlfile = os.path.join(self.work_dir, self.model_name, 'modelDescription.xml')
@@ -123,6 +169,9 @@ class TC3CommNetwork(mosaik_api.Simulator):
 
         self.adjust_var_table()
 
+        self.output_names = [ name for name in self.var_table['output'].keys() if name != self.event_var_name ]
+        self.drain_var_names = self.output_names + [ self.event_var_name ]
+
         return self.meta
 
     def create(self, num, model):
@@ -160,14 +209,22 @@ class TC3CommNetwork(mosaik_api.Simulator):
 
             # Handling tracking internal fmu times
             self.fmutimes[eid] = self.start_time*self.sec_per_mt
-            self.fmuwanttimes[eid] = self.stop_time*self.sec_per_mt
+            self.fmuwanttimes[eid] = fmu.getReal( [ self.event_var_name ] )[0]
 
             # Message ID tracker
             self.msgcounters[eid] = itertools.count(start=1) # msgIDs start at 1, as 0 == no msg
-            self.msgtable[eid] = {} # Table containing msgID -> message information
+            self.msgtable[eid] = MessageTable( self.msg_table_size ) # Table containing msgID -> message information
 
             # Outbound message queue
             self.outqueue[eid] = {}
+            self.outlatency[eid] = {}
+            self.localqueue[eid] = []
+            self.trace_records[eid] = []
+            self.learned_delays[eid] = []
+
+            # Latency histograms per channel (u3, u4, ctrl)
+            self.latencies[eid] = { input_name: LatencyHistogram( self.latency_bin_width )
+                for input_name in self.translation_table['input'].keys() }
 
             entities.append({'eid': eid, 'type': model, 'rel': []})
 
@@ -182,85 +239,151 @@ class TC3CommNetwork(mosaik_api.Simulator):
         # This is the internaltime we want to step our queues to
         target_time = ( time + self.start_time )*self.sec_per_mt
 
-        for eid, fmu in self._entities.items():
-            # Process outputs
-            # Clear output queue
-            self.outqueue[eid] = {}
+        # Step the entities (possibly in parallel), then merge their results in the order of their IDs.
+        results = self.stepper.map( lambda eid: self.step_entity( eid, target_time, inputs.get( eid, {} ) ), self._entities )
 
-            # Grab the time of next event
-            next_event_time = fmu.getReal( [ self.event_var_name ] )[0]
-            self.fmuwanttimes[eid] = next_event_time
-
-            # While we have output messages waiting, step the queue along and store the output in self.outqueue
-            while self.fmuwanttimes[eid] < target_time + self.time_diff_resolution:
-
-                if self.verbose: print( 'QUEUE: About to step from fmutime = {}, to fmuwanttime = {}'.format( self.fmutimes[eid], self.fmuwanttimes[eid] ) )
-                # Update the internal state of the FMU to the time of the next event,
-
-                fmu.doStep(
-                    current_communication_point = self.fmutimes[eid],
-                    communication_step_size = self.fmuwanttimes[eid]-self.fmutimes[eid]
-                    )
-                # Save the current internal time
-
-                self.fmutimes[eid] = self.fmuwanttimes[eid]
-                # Update the internal state of the FMU to the time of the next event,
-                fmu.doStep(
-                    current_communication_point = self.fmutimes[eid],
-                    communication_step_size = 0
-                    )
-
-                for attr in self.var_table['output'].keys():
-                    if attr == self.event_var_name: continue
-
-                    msg_id = self.get_value(eid, attr)
-                    # msg_id == 0 => no msg
-                    if msg_id > 0:
-                        # A message is here! Append it to the message queue!
-                        [ input_name, val ] = self.msgtable[eid][msg_id]
-                        self.outqueue[eid][input_name] = val
-                        if self.verbose: print( 'OUTPUT MESSAGE: {} from {}, msg_id = {}'.format( val, input_name, msg_id ) )
-
-                next_event_time = fmu.getReal( [ self.event_var_name ] )[0]
-                self.fmuwanttimes[eid] = next_event_time
-
-            # Step our FMU to the current time
-            if self.fmutimes[eid] < target_time - self.time_diff_resolution:
-                if self.verbose: print( 'QUEUE: About to step from fmutime = {} to target_time = {}'.format( self.fmutimes[eid], target_time ) )
-                fmu.doStep(
-                    current_communication_point = self.fmutimes[eid],
-                    communication_step_size = target_time-self.fmutimes[eid]
-                    )
-                # Save the current internal time
-                self.fmutimes[eid] = target_time
-
-            # Process inputs
-            inputdata = inputs.get(eid, {})
-
-            # Set inputs to FMU if any input port is nonzero
-            for input_name, vals in inputdata.items():
-                for source, val in vals.items():
-                    if val is not None:
-                        msg_id = next( self.msgcounters[eid] )
-                        self.msgtable[eid][msg_id] = [ input_name, val ]
-                        if self.verbose:
-                            print( 'INPUT MESSAGE: {0} from {1}, assigned msg_id = {2}.'.format( val, input_name, msg_id ) )
-                        self.set_values( eid, { input_name: msg_id }, 'input' )
-
-            # Conduct a zero-length step to process inputs
+        for eid, ( hits, misses ) in zip( sorted( self._entities ), results ):
+            self.delay_cache_hits += hits
+            self.delay_cache_misses += misses
+            for key, delay in self.learned_delays[eid]:
+                DELAY_CACHE.setdefault( key, delay )
+            self.learned_delays[eid] = []
+            if self.trace is not None:
+                for record in self.trace_records[eid]:
+                    self.trace.write( *record )
+                self.trace_records[eid] = []
+
+        #Update our external belief about the current time
+        self.current_time = time
+
+        return time + 1
+
+
+    def step_entity(self, eid, target_time, inputdata):
+        '''Step a single entity to the target time and send its new messages. Only changes the state of the
+        entity itself, delays learned and messages delivered are merged by step. Returns the number of delay
+        cache hits and misses.'''
+        fmu = self._entities[eid]
+        hits = 0
+        misses = 0
+
+        # Process outputs
+        # Clear output queue
+        self.outqueue[eid] = {}
+        self.outlatency[eid] = {}
+
+        # Process all events up to the target time (the time of the next event is known from the last step).
+        self.drain_events( eid, fmu, target_time )
+
+        # Step our FMU to the current time
+        if self.fmutimes[eid] < target_time - self.time_diff_resolution:
+            if self.verbose: print( 'QUEUE: About to step from fmutime = {} to target_time = {}'.format( self.fmutimes[eid], target_time ) )
             fmu.doStep(
                 current_communication_point = self.fmutimes[eid],
-                communication_step_size = 0.
+                communication_step_size = target_time-self.fmutimes[eid]
                 )
+            # Save the current internal time
+            self.fmutimes[eid] = target_time
+
+        # Process inputs
+        messages = [ ( input_name, val ) for input_name, vals in inputdata.items()
+            for source, val in vals.items() if val is not None ]
+
+        # The delay of a message only depends on the channels sending at the same time. If the delays
+        # of all messages are known, deliver them without the FMU. Otherwise, learn them from the FMU.
+        delay_keys = {}
+        if self.delay_cache and messages:
+            sending = frozenset( input_name for input_name, val in messages )
+            delay_keys = { input_name: ( self.work_dir, self.model_name, self.fmu_digest, self.random_seed, sending, input_name )
+                for input_name in sending }
+            if all( key in DELAY_CACHE for key in delay_keys.values() ):
+                hits += len( messages )
+                for input_name, val in messages:
+                    delivery_time = self.fmutimes[eid] + DELAY_CACHE[ delay_keys[input_name] ]
+                    heapq.heappush( self.localqueue[eid],
+                        ( delivery_time, next( self.msgcounters[eid] ), input_name, val, self.fmutimes[eid] ) )
+                    if self.verbose: print( 'INPUT MESSAGE: {0} from {1}, known delay.'.format( val, input_name ) )
+                messages = []
+            else:
+                misses += len( messages )
+
+        # Set inputs to FMU if any input port is nonzero (all in one batch)
+        input_msg_ids = {}
+        for input_name, val in messages:
+            msg_id = next( self.msgcounters[eid] )
+            self.msgtable[eid].add( msg_id, input_name, val, self.fmutimes[eid], delay_keys.get( input_name ) )
+            if self.verbose:
+                print( 'INPUT MESSAGE: {0} from {1}, assigned msg_id = {2}.'.format( val, input_name, msg_id ) )
+            input_msg_ids[ self.translation_table['input'][input_name] ] = msg_id
+        if input_msg_ids:
+            fmu.setValues( list( input_msg_ids.keys() ), list( input_msg_ids.values() ) )
+
+        # Conduct a zero-length step to process inputs
+        fmu.doStep(
+            current_communication_point = self.fmutimes[eid],
+            communication_step_size = 0.
+            )
 
-            next_event_time = fmu.getReal( [ self.event_var_name ] )[0]
-            if self.verbose: print( 'FMU: next_event_time = {}'.format( next_event_time ) )
-            self.fmuwanttimes[eid] = next_event_time
+        next_event_time = fmu.getReal( [ self.event_var_name ] )[0]
+        if self.verbose: print( 'FMU: next_event_time = {}'.format( next_event_time ) )
+        self.fmuwanttimes[eid] = next_event_time
 
-        #Update our external belief about the current time
-        self.current_time = time
+        return hits, misses
 
-        return time + 1
+
+    def drain_events(self, eid, fmu, target_time):
+        '''Step the FMU to each event up to the target time and store the output messages in self.outqueue.
+        After each event, the message outputs and the time of the next event are read in one batch.
+        Messages delivered without the FMU (see DELAY_CACHE) are merged in the order of their delivery times.'''
+        localqueue = self.localqueue[eid]
+        while True:
+            if localqueue and localqueue[0][0] < min( self.fmuwanttimes[eid], target_time + self.time_diff_resolution ):
+                ( delivery_time, _, input_name, val, send_time ) = heapq.heappop( localqueue )
+                self.deliver( eid, input_name, val, send_time, delivery_time )
+                continue
+
+            if self.fmuwanttimes[eid] >= target_time + self.time_diff_resolution: break
+
+            if self.verbose: print( 'QUEUE: About to step from fmutime = {}, to fmuwanttime = {}'.format( self.fmutimes[eid], self.fmuwanttimes[eid] ) )
+            # Update the internal state of the FMU to the time of the next event,
+            fmu.doStep(
+                current_communication_point = self.fmutimes[eid],
+                communication_step_size = self.fmuwanttimes[eid]-self.fmutimes[eid]
+                )
+            # Save the current internal time
+            self.fmutimes[eid] = self.fmuwanttimes[eid]
+
+            # Conduct a zero-length step to retrieve the outputs at this event
+            fmu.doStep(
+                current_communication_point = self.fmutimes[eid],
+                communication_step_size = 0
+                )
+
+            values = fmu.getValues( self.drain_var_names )
+
+            for attr, msg_id in zip( self.output_names, values ):
+                # msg_id == 0 => no msg
+                if msg_id > 0:
+                    # A message is here! Append it to the message queue (and remove it from the message table)!
+                    message = self.msgtable[eid].pop( msg_id )
+                    if message is None: continue # Already delivered.
+                    [ input_name, val, send_time, delay_key ] = message
+                    self.deliver( eid, input_name, val, send_time, self.fmutimes[eid] )
+                    if delay_key is not None: self.learned_delays[eid].append( ( delay_key, self.fmutimes[eid] - send_time ) )
+                    if self.verbose: print( 'OUTPUT MESSAGE: {} from {}, msg_id = {}'.format( val, input_name, msg_id ) )
+
+            self.fmuwanttimes[eid] = values[-1]
+
+
+    def deliver(self, eid, input_name, val, send_time, delivery_time):
+        '''Append a message to the message queue and record its latency (and the message in the trace).'''
+        latency = delivery_time - send_time
+        if self.trace is not None:
+            self.trace_records[eid].append( ( input_name.replace( '_send', '' ), send_time, delivery_time, self.random_seed ) )
+        self.outqueue[eid][input_name] = val
+        self.outlatency[eid][input_name] = latency
+        self.latencies[eid][input_name].add( latency )
+        if self.verbose: print( 'DELIVERED: {} from {}, latency = {}'.format( val, input_name, latency ) )
 
 
     def get_data(self, outputs):
@@ -273,6 +396,9 @@ class TC3CommNetwork(mosaik_api.Simulator):
                 if attr == 'current_time':
                     data[eid][attr] = self.current_time
                     # print('current time: ', self.current_time)
+                elif attr.endswith( '_latency' ):
+                    send = attr.replace( '_latency', '_send' )
+                    data[eid][attr] = self.outlatency[eid].get( send )
                 else:
                     receive = attr
                     send = receive.replace( '_receive', '_send' )
@@ -281,6 +407,26 @@ class TC3CommNetwork(mosaik_api.Simulator):
 
         return data
 
+    def finalize(self):
+        '''Print the latency histograms of all channels.'''
+        for eid, histograms in self.latencies.items():
+            for input_name, histogram in sorted( histograms.items() ):
+                print( '{0} - latency of channel {1}: {2}'.format( eid, input_name.replace( '_send', '' ), histogram ) )
+            print( '{0} - messages not delivered: {1} lost (table overflow), {2} in flight'.format(
+                eid, self.msgtable[eid].n_lost, self.msgtable[eid].n_in_flight + len( self.localqueue[eid] ) ) )
+        if self.delay_cache:
+            print( 'Delay cache: {0} hits, {1} misses'.format( self.delay_cache_hits, self.delay_cache_misses ) )
+        if self.trace is not None:
+            self.trace.close()
+            print( 'Wrote {0} messages to trace'.format( self.trace.n_records ) )
+
+        if self.stepper is not None:
+            self.stepper.close()
+
+        # Free the FMU instances now (not only when the simulator is garbage collected), in case the
+        # process keeps running (see run_worker).
+        self._entities.clear()
+
     def adjust_var_table(self):
         '''Helper function that adds missing keys to the var_table and its associated translation table.
         Avoids errors due to faulty access later on.'''
@@ -310,5 +456,43 @@ class TC3CommNetwork(mosaik_api.Simulator):
         return val
 
 
+def run_worker():
+    '''Serve consecutive mosaik runs from the same process (option --worker), so that the startup of the shell,
+    the Python interpreter and the FMU stack is only paid once. The worker listens at the address given on the
+    command line (like a simulator started with option --remote) and is attached to with a 'connect' entry in
+    the sim config. Each run gets a fresh simulator, which mosaik (re-)initializes with its call to init.
+    The worker stops when it is interrupted while waiting for mosaik.'''
+    argv = [ arg for arg in sys.argv if arg != '--worker' ]
+    if '--remote' not in argv and '-r' not in argv:
+        argv.append( '--remote' )
+
+    n_runs = 0
+    while True:
+        sys.argv = list( argv ) # The argument parser of mosaik_api reads sys.argv.
+        sim = TC3CommNetwork()
+        status = mosaik_api.start_simulation( sim )
+        if sim.sid is None:
+            if status == 0: break # Interrupted before mosaik connected.
+            continue # No connection from mosaik in time, keep waiting.
+
+        n_runs += 1
+        print( 'Worker finished run {0} (status {1})'.format( n_runs, status ) )
+        del sim
+        gc.collect()
+
+
+def run_shm( shm_file ):
+    '''Serve a ShmSimulatorProxy in the mosaik process through shared memory (option --shm).'''
+    if 'cygwin' in sys.platform:
+        from utils_cygwin import Cygpath
+        shm_file = Cygpath().win2posix( shm_file )
+    serve_shm( TC3CommNetwork(), shm_file )
+
+
 if __name__ == '__main__':
-    mosaik_api.start_simulation( TC3CommNetwork() )
\ No newline at end of file
+    if '--worker' in sys.argv:
+        run_worker()
+    elif '--shm' in sys.argv:
+        run_shm( sys.argv[ sys.argv.index( '--shm' ) + 1 ] )
+    else:
+        mosaik_api.start_simulation( TC3CommNetwork() )
\ No newline at end of file
@@ -17,5 +17,5 @@ source /usr/bin/virtualenvwrapper.sh
 # Start virtual environment.
 workon $1
 
-# Start the collector.
-python tc3_comm_ns3_fmu.py $2
+# Start the simulator (further arguments are passed on, e.g., option --worker).
+python tc3_comm_ns3_fmu.py "${@:2}"
@@ -8,6 +8,10 @@ from itertools import count
 import fmipp
 import xml.etree.ElementTree as ETree
 import os.path
+import math
+from fmu_extraction import extract_fmu
+from fmu_pool import PooledFMUSimulator
+from entity_stepper import EntityStepper, warn_gil_bound
 
 
 META = {
@@ -22,7 +26,7 @@ META = {
 
 
 
-class TC3Controller(mosaik_api.Simulator):
+class TC3Controller(PooledFMUSimulator, mosaik_api.Simulator):
 
     def __init__(self):
         super().__init__(META)
@@ -48,13 +52,18 @@ class TC3Controller(mosaik_api.Simulator):
         self.uri_to_extracted_fmu = None
         self.sec_per_mt = 1                 # Number of seconds of internaltime per mosaiktime
         self.fmutimes = {}                  # Keeping track of each FMU's internal time
+        self.fmu_time_offsets = {}          # FMU's internal time at start_time (reused FMUs continue from their last time)
+        self.fmu_taps = {}                  # FMU's internal tap position
+        self.tap_offsets = {}               # FMU's tap at start_time (reused FMUs continue from their last tap)
+        self.pool_size = 0                  # max. number of FMU instances kept alive for reuse (0 = no reuse)
+        self.stepper = None                 # steps the FMUs one after the other or on a thread pool (see entity_stepper.EntityStepper)
         self.verbose = False
 
 
     def init( self, sid, work_dir, model_name, instance_name, dead_time=0, start_time=0, stop_time=0,
         logging_on = False, time_diff_resolution=1e-9, timeout=0, interactive=False, visible=False,
         stop_time_defined=False, seconds_per_mosaik_timestep=1, var_table=None, translation_table=None,
-        verbose=False ):
+        pool_size=0, n_threads=0, verbose=False ):
 
         self.dead_time = dead_time / seconds_per_mosaik_timestep
         self.work_dir = work_dir
@@ -69,11 +78,14 @@ class TC3Controller(mosaik_api.Simulator):
         self.visible = visible
         self.stop_time_defined = stop_time_defined
         self.sec_per_mt = seconds_per_mosaik_timestep # Number of seconds of internaltime per mosaiktime (Default: 1, mosaiktime measured in seconds)
+        self.pool_size = pool_size
+        self.stepper = EntityStepper( n_threads )
+        warn_gil_bound( n_threads, 'TC3Controller' )
         self.verbose = verbose
 
         path_to_fmu = os.path.join(self.work_dir, self.model_name + '.fmu')
         if self.verbose: print('Attempted to extract FMU {0}, Path {1}'.format(path_to_fmu, self.work_dir))
-        self.uri_to_extracted_fmu = fmipp.extractFMU(path_to_fmu, self.work_dir)
+        self.uri_to_extracted_fmu = extract_fmu(path_to_fmu, self.work_dir, verbose=self.verbose)
         assert self.uri_to_extracted_fmu is not None
 
         # If no variable table is given by user, parse the modelDescription.xml for a table -
@@ -100,17 +112,17 @@ class TC3Controller(mosaik_api.Simulator):
 
             if self.verbose: print('{0}, {1}, {2}, {3}'.format(self.uri_to_extracted_fmu, self.model_name, self.logging_on, self.time_diff_resolution))
 
-            fmu = fmipp.FMUCoSimulationV1( self.uri_to_extracted_fmu, self.model_name,
-                self.logging_on, self.time_diff_resolution )
+            ( fmu, state ) = self.acquire_fmu()
             self._entities[eid] = fmu
 
-            status = self._entities[eid].instantiate( self.instance_name, self.timeout,
-                self.visible, self.interactive )
-            assert status == fmipp.fmiOK
-
-            status = self._entities[eid].initialize( self.start_time*self.sec_per_mt,
-                self.stop_time_defined, self.stop_time*self.sec_per_mt )
-            assert status == fmipp.fmiOK
+            # Reused FMUs continue from their last time and tap position (the inputs are reset below).
+            if state is None:
+                self.fmu_time_offsets[eid] = 0
+                self.fmu_taps[eid] = 0
+            else:
+                self.fmu_time_offsets[eid] = state['time'] - self.start_time*self.sec_per_mt
+                self.fmu_taps[eid] = state['tap']
+            self.tap_offsets[eid] = self.fmu_taps[eid]
 
             self.data[eid] = { 'tap': 0 }
             self.set_values( eid, { 'u3': 1., 'u4': 1., 'vlow': vlow, 'vup': vup }, 'input' )
@@ -132,13 +144,9 @@ class TC3Controller(mosaik_api.Simulator):
         # This is the internal time.
         target_time = ( time + self.start_time )*self.sec_per_mt
 
-        for eid, fmu in self._entities.items():
-            status = fmu.doStep( self.fmutimes[eid], target_time - self.fmutimes[eid], True )
-            assert status == fmipp.fmiOK
-
-            self.fmutimes[eid] += target_time - self.fmutimes[eid]
-
-        for eid, edata in self.data.items():
+        # The FMUs are only advanced in time when a decision is needed (see decide_on_tap).
+        decisions = {} # entity ID -> (u3, u4)
+        for eid, edata in sorted( self.data.items() ):
             input_data = inputs.get(eid, {})
 
             [ ( _, u3 ) ] = input_data['u3'].items() if 'u3' in input_data else [ ( None, None ) ]
@@ -147,13 +155,7 @@ class TC3Controller(mosaik_api.Simulator):
 
             if True is self.is_responsive[eid]: # Controller is responsive.
                 if u3 is not None or u4 is not None:
-                    new_tap = self.decide_on_tap(eid, u3, u4)
-                    edata['tap'] = new_tap
-                    if self.verbose: print( "Decided on tap {} at time {}".format( new_tap, time ) )
-
-                    # Enter dead time.
-                    self.is_responsive[eid] = False
-                    self.wakeup_time[eid] = time + self.dead_time
+                    decisions[eid] = ( u3, u4 )
                 else:
                     edata['tap'] = None # No inputs --> no output.
             else: # Controller is not responsive (dead time).
@@ -161,20 +163,55 @@ class TC3Controller(mosaik_api.Simulator):
                     self.wakeup_time[eid] = None
                     self.is_responsive[eid] = True
 
-        return time + 1
+        # Decide on the taps (possibly in parallel), then store them in the order of the entity IDs.
+        new_taps = self.stepper.map( lambda eid: self.decide_on_tap( eid, decisions[eid][0], decisions[eid][1], target_time ), decisions )
+
+        for eid, new_tap in zip( sorted( decisions ), new_taps ):
+            self.data[eid]['tap'] = new_tap
+            if self.verbose: print( "Decided on tap {} at time {}".format( new_tap, time ) )
+
+            # Enter dead time.
+            self.is_responsive[eid] = False
+            self.wakeup_time[eid] = time + self.dead_time
 
+        # Mosaik only provides inputs when the simulator steps, so responsive controllers have to step at
+        # every time step. When all controllers are in dead time, wake up when the first one becomes responsive.
+        if not self.wakeup_time or any( self.is_responsive.values() ):
+            return time + 1
+        return max( time + 1, int( math.ceil( min( self.wakeup_time.values() ) ) ) )
 
-    def decide_on_tap( self, eid, u3, u4 ):
+
+    def decide_on_tap( self, eid, u3, u4, target_time ):
+
+        # Advance the FMU across the whole gap since the last decision.
+        if self.fmutimes[eid] < target_time:
+            status = self._entities[eid].doStep( self.fmutimes[eid] + self.fmu_time_offsets[eid],
+                target_time - self.fmutimes[eid], True )
+            assert status == fmipp.fmiOK
+
+            self.fmutimes[eid] = target_time
 
         fmu_inputs = {}
         if u3 is not None: fmu_inputs['u3'] = u3
         if u4 is not None: fmu_inputs['u4'] = u4
         self.set_values( eid, fmu_inputs, 'input' )
 
-        status = self._entities[eid].doStep( self.fmutimes[eid], 0, True )
+        status = self._entities[eid].doStep( self.fmutimes[eid] + self.fmu_time_offsets[eid], 0, True )
         assert status == fmipp.fmiOK
 
-        return self.get_value( eid, 'tap' )
+        self.fmu_taps[eid] = self.get_value( eid, 'tap' )
+        return self.fmu_taps[eid] - self.tap_offsets[eid]
+
+
+    def finalize(self):
+        if self.stepper is not None:
+            self.stepper.close()
+
+        self.release_fmus()
+
+
+    def get_pool_state(self, eid):
+        return { 'tap': self.fmu_taps[eid] }
 
 
     def get_data(self, outputs):
@@ -0,0 +1,135 @@
+"""
+    A controller implementing a (too) simple coordinated voltage control algorithm.
+    Native implementation of the control algorithm of the MATLAB FMU (see fmus/matlab_controller_fmu/TC3_Controller.m),
+    the states of all entities are stored in arrays and updated at once.
+"""
+
+import mosaik_api
+from itertools import count
+import numpy as np
+import math
+
+
+META = {
+    'models': {
+        'TC3Controller': {
+            'public': True,
+            'params': ['vlow', 'vup'],
+            'attrs': ['u3', 'u4', 'tap'],
+        },
+    },
+}
+
+
+
+class TC3Controller(mosaik_api.Simulator):
+
+    def __init__(self):
+        super().__init__(META)
+        self.eid_counters = {}
+        self.index = {}                     # eid -> index in state arrays
+        self.u3 = np.zeros(0)               # last received voltage readings
+        self.u4 = np.zeros(0)
+        self.vlow = np.zeros(0)             # voltage limits
+        self.vup = np.zeros(0)
+        self.tap = np.zeros(0, dtype=int)   # internal tap state of controller
+        self.has_output = np.zeros(0, dtype=bool) # controller outputs its tap position (when responsive)
+        self.is_responsive = np.zeros(0, dtype=bool) # controller state regarding dead time
+        self.wakeup_time = np.zeros(0)      # time stamp until end of dead time
+        self.dead_time = 0                  # dead time of controller
+        self.verbose = False
+
+
+    def init( self, sid, dead_time=0, seconds_per_mosaik_timestep=1, verbose=False ):
+
+        self.dead_time = dead_time / seconds_per_mosaik_timestep
+        self.verbose = verbose
+
+        return self.meta
+
+
+    def create(self, num, model, vlow=0.95, vup=1.05):
+        counter = self.eid_counters.setdefault(model, count())
+
+        entities = []
+
+        for i in range(num):
+            eid = '%s_%s' % (model, next(counter))  # entity ID
+            self.index[eid] = len( self.index )
+            entities.append( { 'eid': eid, 'type': model, 'rel': [] } )
+
+        # Same initial inputs as for the FMU-based controller.
+        self.u3 = np.append( self.u3, np.ones( num ) )
+        self.u4 = np.append( self.u4, np.ones( num ) )
+        self.vlow = np.append( self.vlow, np.full( num, vlow ) )
+        self.vup = np.append( self.vup, np.full( num, vup ) )
+        self.tap = np.append( self.tap, np.zeros( num, dtype=int ) )
+        self.has_output = np.append( self.has_output, np.ones( num, dtype=bool ) )
+        self.is_responsive = np.append( self.is_responsive, np.ones( num, dtype=bool ) )
+        self.wakeup_time = np.append( self.wakeup_time, np.full( num, np.inf ) )
+
+        return entities
+
+
+    def step(self, time, inputs):
+
+        # Collect new voltage readings (NaN = no input).
+        u3 = np.full( len( self.index ), np.nan )
+        u4 = np.full( len( self.index ), np.nan )
+        for eid, input_data in inputs.items():
+            i = self.index[eid]
+            [ ( _, u3_in ) ] = input_data['u3'].items() if 'u3' in input_data else [ ( None, None ) ]
+            [ ( _, u4_in ) ] = input_data['u4'].items() if 'u4' in input_data else [ ( None, None ) ]
+            if u3_in is not None: u3[i] = u3_in
+            if u4_in is not None: u4[i] = u4_in
+
+        has_u3 = ~np.isnan( u3 )
+        has_u4 = ~np.isnan( u4 )
+        was_responsive = self.is_responsive.copy()
+
+        # Responsive controllers without inputs have no output.
+        self.has_output[was_responsive] = False
+
+        # Responsive controllers with inputs decide on the tap position (see decideOnTap in TC3_Controller.m).
+        deciding = was_responsive & ( has_u3 | has_u4 )
+        self.u3[deciding & has_u3] = u3[deciding & has_u3]
+        self.u4[deciding & has_u4] = u4[deciding & has_u4]
+        umin = np.minimum( self.u3, self.u4 )
+        umax = np.maximum( self.u3, self.u4 )
+        self.tap += deciding & ( umax > self.vup )
+        self.tap -= deciding & ( umin < self.vlow )
+        self.has_output[deciding] = True
+        if self.verbose and deciding.any():
+            print( "Decided on taps {} at time {}".format( self.tap[deciding], time ) )
+
+        # Enter dead time.
+        self.is_responsive[deciding] = False
+        self.wakeup_time[deciding] = time + self.dead_time
+
+        # Controllers in dead time become responsive again.
+        waking = ~was_responsive & ( time >= self.wakeup_time )
+        self.is_responsive[waking] = True
+        self.wakeup_time[waking] = np.inf
+
+        # Mosaik only provides inputs when the simulator steps, so responsive controllers have to step at
+        # every time step. When all controllers are in dead time, wake up when the first one becomes responsive.
+        if len( self.index ) == 0 or self.is_responsive.any():
+            return time + 1
+        return max( time + 1, int( math.ceil( self.wakeup_time.min() ) ) )
+
+
+    def get_data(self, outputs):
+        data = {}
+        for eid, attrs in outputs.items():
+            i = self.index[eid]
+            mydata = {}
+            for attr in attrs:
+                if attr != 'tap':
+                    raise RuntimeError("OLTC controller has no attribute {0}".format(attr))
+                mydata[attr] = int( self.tap[i] ) if self.is_responsive[i] and self.has_output[i] else None
+            data[eid] = mydata
+        return data
+
+
+if __name__ == '__main__':
+    mosaik_api.start_simulation(TC3Controller())
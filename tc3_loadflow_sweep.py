@@ -0,0 +1,50 @@
+"""
+    Solve the TC3 load flow for a grid of operating points (loads and tap positions) at once,
+    using the NumPy load flow (see tc3_powersystem_numpy.py). Results are written to a CSV file.
+
+    EXPERIMENTAL: the network parameters of the NumPy load flow are not calibrated, the results are
+    not comparable to those of the PowerFactory FMU.
+"""
+
+import argparse
+import csv
+import numpy as np
+
+from tc3_powersystem_numpy import LVNetwork
+from tc3_sweep import grid_points
+
+
+def solve_points( points, network=None ):
+    '''Solve the load flow for a list of operating points (dicts with keys L_3, L_4 and tap).
+    Returns the points with the resulting voltages added.'''
+    lv_network = LVNetwork() if network is None else LVNetwork( network )
+
+    loads = { attr: np.array( [ point[attr] for point in points ], dtype=float ) for attr in lv_network.load_attrs }
+    tap = np.array( [ point['tap'] for point in points ] )
+    voltages, _ = lv_network.solve_batch( loads, tap )
+
+    return [ dict( point, **{ attr: float( u[i] ) for attr, u in voltages.items() } ) for i, point in enumerate( points ) ]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Solve the TC3 load flow for a grid of operating points (EXPERIMENTAL: uncalibrated NumPy load flow, not comparable to PowerFactory)')
+    parser.add_argument( '--L_3', type=float, nargs='+', help='loads at bus 3 in kW', required=True )
+    parser.add_argument( '--L_4', type=float, nargs='+', help='loads at bus 4 in kW', required=True )
+    parser.add_argument( '--tap', type=int, nargs='+', help='tap positions', default=[ 0 ] )
+    parser.add_argument( '--output_file', type=str, help='output file name', default='loadflow_sweep.csv' )
+    args = parser.parse_args()
+
+    print( 'WARNING: the NumPy load flow is experimental, its results are not comparable to those of the PowerFactory FMU' )
+    points = solve_points( grid_points( { 'L_3': args.L_3, 'L_4': args.L_4, 'tap': args.tap } ) )
+
+    with open( args.output_file, 'w', newline='' ) as f:
+        writer = csv.DictWriter( f, fieldnames=sorted( points[0] ) )
+        writer.writeheader()
+        writer.writerows( points )
+
+    print( 'Solved {0} operating points, results written to {1}'.format( len( points ), args.output_file ) )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""
+    Simulate the power system with an in-process load flow (NumPy), as an alternative to the PF FMU.
+
+    EXPERIMENTAL: the parameters in DEFAULT_NETWORK are placeholders, not calibrated against the
+    PowerFactory model. Results are therefore not comparable to those of the PF FMU.
+
+    The LV feeder of the TC3 network (OLTC transformer, lines and the two loads) is solved with a
+    backward/forward sweep, warm-started from the previous solution. The network parameters are given
+    as a dict (see DEFAULT_NETWORK), they should be adapted to match the PowerFactory model Erigrid_LV.pfd.
+
+    Many operating points can be solved at once (see LVNetwork.solve_batch, used by tc3_loadflow_sweep.py).
+    In ensemble mode (parameter replicas), one entity holds several replicas of the power system, whose
+    outputs are lists. Scalar inputs are broadcast to all replicas, so the replicas only differ if the
+    inputs are given as lists (one value per replica).
+"""
+
+import mosaik_api
+from itertools import count
+import numpy as np
+import math
+
+
+META = {
+    'models': {
+        'TC3PowerSystem': {
+            'public': True,
+            'params': ['L_3', 'L_4', 'replicas'],
+            'attrs': ['tap', 'L_3', 'L_4', 'U3', 'U4', 'current_tap'],
+        },
+    },
+}
+
+
+# Parameters of the radial LV network. Lines have to be listed such that the from-bus of each line
+# is either the transformer's LV bus or the to-bus of a line listed before.
+# NOTE: these are placeholder values, NOT calibrated against the PowerFactory model Erigrid_LV.pfd.
+DEFAULT_NETWORK = {
+    's_base': 100.,                         # base power in kVA
+    'v_base': 400.,                         # base voltage (line-to-line) in V
+    'v_slack': 1.0,                         # voltage at the MV side of the transformer in p.u.
+    'trafo': {
+        'lv_bus': 'LVBus1',                 # LV bus of the transformer
+        'r': 0.0064,                        # resistance in Ohm (referred to the LV side)
+        'x': 0.0256,                        # reactance in Ohm (referred to the LV side)
+        'tap_step': 0.025,                  # additional voltage per tap position at the MV side in p.u.
+    },
+    'lines': [                              # ( from bus, to bus, resistance in Ohm, reactance in Ohm )
+        ( 'LVBus1', 'LVBus2', 0.20, 0.06 ),
+        ( 'LVBus2', 'LVBus3', 0.35, 0.08 ),
+        ( 'LVBus2', 'LVBus4', 0.55, 0.12 ),
+    ],
+    'loads': {                              # load attr: ( bus, power factor )
+        'L_3': ( 'LVBus3', 1. ),
+        'L_4': ( 'LVBus4', 1. ),
+    },
+    'outputs': {                            # voltage attr: bus
+        'U3': 'LVBus3',
+        'U4': 'LVBus4',
+    },
+}
+
+
+class LVNetwork:
+    '''Load flow of a radial LV network with an OLTC transformer (backward/forward sweep).'''
+
+    def __init__(self, network=DEFAULT_NETWORK, tolerance=1e-10, max_iter=100):
+        self.tolerance = tolerance
+        self.max_iter = max_iter
+        self.v_slack = network['v_slack']
+        self.tap_step = network['trafo']['tap_step']
+        self.s_base = network['s_base']
+        z_base = network['v_base']**2 / ( network['s_base']*1e3 )
+
+        # Bus 0 is the transformer's LV bus, branch k connects bus k to its parent (branch 0 is the transformer).
+        trafo = network['trafo']
+        self.buses = [ trafo['lv_bus'] ]
+        parents = [ None ]
+        z = [ complex( trafo['r'], trafo['x'] ) / z_base ]
+        for ( from_bus, to_bus, r, x ) in network['lines']:
+            if from_bus not in self.buses:
+                raise RuntimeError("Line from {0} to {1} is not connected to the network.".format(from_bus, to_bus))
+            parents.append( self.buses.index( from_bus ) )
+            self.buses.append( to_bus )
+            z.append( complex( r, x ) / z_base )
+        n = len( self.buses )
+
+        # Branch currents from bus currents: bibc[k, i] = 1 if bus i is supplied through branch k.
+        bibc = np.zeros( ( n, n ) )
+        for i in range( n ):
+            k = i
+            while k is not None:
+                bibc[k, i] = 1.
+                k = parents[k]
+
+        # Voltage drop at each bus caused by the bus currents.
+        self.dlf = bibc.T @ ( np.array( z )[:, None] * bibc )
+
+        self.load_attrs = sorted( network['loads'] )
+        self.load_buses = np.array( [ self.buses.index( network['loads'][attr][0] ) for attr in self.load_attrs ] )
+        pf = np.array( [ network['loads'][attr][1] for attr in self.load_attrs ] )
+        self.q_factor = np.sqrt( 1. - pf**2 ) / pf
+
+        self.output_attrs = sorted( network['outputs'] )
+        self.output_buses = np.array( [ self.buses.index( network['outputs'][attr] ) for attr in self.output_attrs ] )
+
+    def solve(self, loads, tap, v_init=None):
+        '''Solve the load flow for the given loads (in kW, ordered as self.load_attrs) and tap position.
+        Returns the complex bus voltages (in p.u.), which can be used as v_init for the next load flow.'''
+        loads = np.asarray( loads, dtype=float )
+        v_source = self.v_slack / ( 1. + np.asarray( tap, dtype=float )*self.tap_step )
+
+        # Several loads may be connected to the same bus (their powers add up).
+        s = np.zeros( ( len( self.buses ), ) + loads.shape[1:], dtype=complex )
+        np.add.at( s, self.load_buses, loads*( 1. + 1j*self.q_factor.reshape( ( -1, ) + ( 1, )*( loads.ndim - 1 ) ) )/self.s_base )
+
+        v = v_source*np.ones_like( s ) if v_init is None else v_init
+        for _ in range( self.max_iter ):
+            v_new = v_source - self.dlf @ np.conj( s/v )
+            if np.max( np.abs( v_new - v ) ) < self.tolerance:
+                return v_new
+            v = v_new
+
+        raise RuntimeError("Load flow did not converge within {0} iterations.".format(self.max_iter))
+
+    def get_voltages(self, v):
+        '''Return the voltage magnitudes of the output buses (ordered as self.output_attrs).'''
+        return np.abs( v[self.output_buses] )
+
+    def solve_batch(self, loads, tap, v_init=None):
+        '''Solve the load flows for K operating points at once. The loads are given as a dict of arrays
+        (e.g., {'L_3': ..., 'L_4': ...}), the tap positions as an array (all of length K or scalars).
+        Returns a dict of arrays of voltage magnitudes (e.g., {'U3': ..., 'U4': ...}) and the complex bus
+        voltages, which can be used as v_init for the next batch.'''
+        shape = np.broadcast( tap, *[ loads[attr] for attr in self.load_attrs ] ).shape
+        load_array = np.array( [ np.broadcast_to( loads[attr], shape ) for attr in self.load_attrs ], dtype=float )
+
+        v = self.solve( load_array, np.broadcast_to( tap, shape ), v_init )
+        return dict( zip( self.output_attrs, self.get_voltages( v ) ) ), v
+
+
+class TC3PowerSystem(mosaik_api.Simulator):
+
+    def __init__(self):
+        super().__init__(META)
+        self.data = {}
+        self.eid_counters = {}
+        self.network = None                 # load flow model of the LV network
+        self.step_size = 1                  # int simulation step size (must be 1 for each sim in JRA2-TC3)
+        self.inputs = {}                    # current load flow inputs (loads and tap) of each entity
+        self.replicas = {}                  # number of replicas of each entity (None = no ensemble)
+        self.voltages = {}                  # complex bus voltages of the last load flow of each entity
+        self.verbose = False
+
+
+    def init( self, sid, step_size, network=None, tolerance=1e-10, max_iter=100, verbose=False ):
+
+        self.step_size = step_size
+        self.network = LVNetwork( network if network is not None else DEFAULT_NETWORK, tolerance, max_iter )
+        self.verbose = verbose
+
+        return self.meta
+
+
+    def create(self, num, model, L_3=0., L_4=0., replicas=None):
+        counter = self.eid_counters.setdefault(model, count())
+
+        entities = []
+
+        for i in range(num):
+            eid = '%s_%s' % (model, next(counter))  # entity ID
+
+            self.inputs[eid] = { 'L_3': L_3, 'L_4': L_4, 'tap': 0 }
+            self.replicas[eid] = replicas
+            self.voltages[eid] = None
+            self.calc_loadflow( eid )
+
+            entities.append( { 'eid': eid, 'type': model, 'rel': [] } )
+
+        return entities
+
+
+    def step(self, time, inputs):
+
+        for eid, input_data in inputs.items():
+
+            [ ( _, l3 ) ] = input_data['L_3'].items() if 'L_3' in input_data else [ ( None, None ) ]
+            [ ( _, l4 ) ] = input_data['L_4'].items() if 'L_4' in input_data else [ ( None, None ) ]
+            [ ( _, tap ) ] = input_data['tap'].items() if 'tap' in input_data else [ ( None, None ) ]
+
+            if self.verbose is True: print( 'time = {} - l3 = {} - l4 = {} - tap = {}'.format( time, l3, l4, tap ) )
+
+            if 0 == math.fmod( time, self.step_size ) or tap is not None:
+                if self.verbose == True: print( 'CALCULATE LOADFLOW at t = {}'.format( time ) )
+
+                if l3 is not None: self.inputs[eid]['L_3'] = l3
+                if l4 is not None: self.inputs[eid]['L_4'] = l4
+                if tap is not None: self.inputs[eid]['tap'] = tap
+
+                self.calc_loadflow( eid )
+
+        return time + 1 # self.step_size
+
+
+    def calc_loadflow(self, eid):
+        '''Solve the load flow of an entity (all its replicas at once in ensemble mode).'''
+        inputs = self.inputs[eid]
+        shape = () if self.replicas[eid] is None else ( self.replicas[eid], )
+        loads = { attr: np.broadcast_to( inputs[attr], shape ) for attr in self.network.load_attrs }
+        tap = np.broadcast_to( inputs['tap'], shape )
+
+        voltages, self.voltages[eid] = self.network.solve_batch( loads, tap, self.voltages[eid] )
+
+        self.data[eid] = { attr: u.tolist() for attr, u in voltages.items() }
+        self.data[eid]['current_tap'] = tap.tolist()
+
+
+    def get_data(self, outputs):
+        data = {}
+        for eid, edata in self.data.items():
+            requests = outputs[eid]
+            mydata = {}
+            for attr in requests:
+                try:
+                    mydata[attr] = edata[attr]
+                except KeyError:
+                    raise RuntimeError("Power system has no attribute {0}".format(attr))
+            data[eid] = mydata
+        return data
+
+
+if __name__ == '__main__':
+    mosaik_api.start_simulation(TC3PowerSystem())
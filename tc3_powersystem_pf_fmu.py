@@ -9,6 +9,18 @@ import fmipp
 import xml.etree.ElementTree as ETree
 import os.path
 import math
+from fmu_extraction import extract_fmu, read_stamp
+from fmu_pool import PooledFMUSimulator
+from entity_stepper import EntityStepper, warn_gil_bound
+
+
+# Load flow results (LRU caches), per FMU (path and digest, so that a replaced FMU does not reuse
+# results of the old one). These are kept at module level, so that consecutive runs in the same
+# process (e.g., workers of a parameter sweep) can reuse them.
+LOADFLOW_CACHES = collections.defaultdict(collections.OrderedDict)
+
+# FMU inputs that determine the result of a load flow.
+LOADFLOW_INPUTS = [ 'ElmLodlv_Load3_plini', 'ElmLodlv_Load4_plini', 'ElmTr2_GridTrafo_nntap' ]
 
 
 META = {
@@ -23,7 +35,7 @@ META = {
 
 
 
-class TC3PowerSystem(mosaik_api.Simulator):
+class TC3PowerSystem(PooledFMUSimulator, mosaik_api.Simulator):
 
     def __init__(self):
         super().__init__(META)
@@ -47,15 +59,26 @@ class TC3PowerSystem(mosaik_api.Simulator):
         self.stop_time_defined = False      # FMI++ parameter
         self.uri_to_extracted_fmu = None
         self.fmutimes = {}                  # Keeping track of each FMU's internal time
+        self.fmu_time_offsets = {}          # FMU's internal time at start_time (reused FMUs continue from their last time)
         self.sec_per_mt = 1                 # Number of seconds of internaltime per mosaiktime
         self.current_tap = 0
+        self.pool_size = 0                  # max. number of FMU instances kept alive for reuse (0 = no reuse)
+        self.initial_inputs = {}            # input values of each FMU right after initialization
+        self.cache_size = 0                 # max. number of cached load flow results (0 = no caching)
+        self.cache_tolerance = 1e-6         # inputs are quantized to multiples of this tolerance for caching
+        self.cache = None                   # cached load flow results (inputs -> outputs)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.inputs = {}                    # current load flow inputs of each entity
+        self.fmu_inputs = {}                # load flow inputs last set to each FMU
+        self.stepper = None                 # steps the FMUs one after the other or on a thread pool (see entity_stepper.EntityStepper)
         self.verbose = False
 
 
     def init( self, sid, work_dir, model_name, instance_name, step_size, start_time=0, stop_time=0,
         logging_on = False, time_diff_resolution=1e-9, timeout=0, interactive=False, visible=False,
         stop_time_defined=False, seconds_per_mosaik_timestep=1, var_table=None, translation_table=None,
-        verbose=False ):
+        cache_size=0, cache_tolerance=1e-6, pool_size=0, n_threads=0, verbose=False ):
 
         self.step_size = step_size
         self.work_dir = work_dir
@@ -70,13 +93,22 @@ class TC3PowerSystem(mosaik_api.Simulator):
         self.visible = visible
         self.stop_time_defined = stop_time_defined
         self.sec_per_mt = seconds_per_mosaik_timestep # Number of seconds of internaltime per mosaiktime (Default: 1, mosaiktime measured in seconds)
+        self.cache_size = cache_size
+        self.cache_tolerance = cache_tolerance
+        self.pool_size = pool_size
+        self.stepper = EntityStepper( n_threads )
+        warn_gil_bound( n_threads, 'TC3PowerSystem' )
         self.verbose = verbose
 
         path_to_fmu = os.path.join(self.work_dir, self.model_name + '.fmu')
         if self.verbose: print('Attempted to extract FMU {0}, Path {1}'.format(path_to_fmu, self.work_dir))
-        self.uri_to_extracted_fmu = fmipp.extractFMU(path_to_fmu, self.work_dir)
+        self.uri_to_extracted_fmu = extract_fmu(path_to_fmu, self.work_dir, verbose=self.verbose)
         assert self.uri_to_extracted_fmu is not None
 
+        # The stamp of the extracted tree holds the digest of the FMU it was extracted from.
+        stamp = read_stamp( os.path.join( self.work_dir, self.model_name ) )
+        self.cache = LOADFLOW_CACHES[ ( os.path.abspath( path_to_fmu ), stamp['digest'] ) ]
+
         '''If no variable table is given by user, parse the modelDescription.xml for a table -
         however, this will not work properly for some FMUs due to varying conventions.'''
         xmlfile = os.path.join( self.work_dir, self.model_name, 'modelDescription.xml' )
@@ -101,17 +133,20 @@ class TC3PowerSystem(mosaik_api.Simulator):
 
             if self.verbose: print('{0}, {1}, {2}, {3}'.format(self.uri_to_extracted_fmu, self.model_name, self.logging_on, self.time_diff_resolution))
 
-            fmu = fmipp.FMUCoSimulationV1( self.uri_to_extracted_fmu, self.model_name,
-                self.logging_on, self.time_diff_resolution )
+            ( fmu, state ) = self.acquire_fmu()
             self._entities[eid] = fmu
 
-            status = self._entities[eid].instantiate( self.instance_name, self.timeout,
-                self.visible, self.interactive )
-            assert status == fmipp.fmiOK
-
-            status = self._entities[eid].initialize( self.start_time*self.sec_per_mt, 
-                self.stop_time_defined, self.stop_time*self.sec_per_mt )
-            assert status == fmipp.fmiOK
+            if state is None:
+                self.fmu_time_offsets[eid] = 0
+                if self.pool_size > 0:
+                    self.initial_inputs[eid] = { k: self.get_value( eid, k, 'input' ) for k in LOADFLOW_INPUTS }
+            else:
+                # Reused FMU: continue from its last time, reset the inputs and recalculate the outputs.
+                self.fmu_time_offsets[eid] = state['time'] - self.start_time*self.sec_per_mt
+                self.initial_inputs[eid] = state['initial_inputs']
+                self.set_values( eid, self.initial_inputs[eid], 'input' )
+                status = fmu.doStep( state['time'], 0, True )
+                assert status == fmipp.fmiOK
 
             self.data[eid] = {
                 'U3': self.get_value( eid, 'ElmTerm_LVBus3_m:u' ),
@@ -122,6 +157,9 @@ class TC3PowerSystem(mosaik_api.Simulator):
             # Handling tracking internal fmu times
             self.fmutimes[eid] = self.start_time*self.sec_per_mt
 
+            self.inputs[eid] = dict.fromkeys( LOADFLOW_INPUTS )
+            self.fmu_inputs[eid] = dict.fromkeys( LOADFLOW_INPUTS )
+
             entities.append( { 'eid': eid, 'type': model, 'rel': [] } )
 
         return entities
@@ -133,7 +171,10 @@ class TC3PowerSystem(mosaik_api.Simulator):
         # This is the internal time.
         target_time = ( time + self.start_time )*self.sec_per_mt
 
-        for eid, input_data in inputs.items():
+        # Load flows that have to be calculated by the FMUs: entity ID -> (FMU inputs, current tap, cache key).
+        load_flows = {}
+
+        for eid, input_data in sorted( inputs.items() ):
         
             [ ( _, l3 ) ] = input_data['L_3'].items() if 'L_3' in input_data else [ ( None, None ) ]
             [ ( _, l4 ) ] = input_data['L_4'].items() if 'L_4' in input_data else [ ( None, None ) ]
@@ -151,26 +192,78 @@ class TC3PowerSystem(mosaik_api.Simulator):
                 if tap is not None:
                     fmu_inputs['ElmTr2_GridTrafo_nntap'] = tap
                     self.current_tap = tap
-                
-                self.set_values( eid, fmu_inputs, 'input' )
 
-                if self.verbose is True: print( 'FMU do step' )
-                communication_point = self.fmutimes[eid]
-                communication_step_size = target_time - self.fmutimes[eid]
-                status = self._entities[eid].doStep( communication_point, communication_step_size, True )
-                assert status == fmipp.fmiOK
-                
-                self.fmutimes[eid] += communication_step_size
+                if self.cache_size > 0:
+                    self.inputs[eid].update( fmu_inputs )
+                    key = self.get_cache_key( eid )
+                    if key in self.cache:
+                        self.cache_hits += 1
+                        self.cache.move_to_end( key )
+                        ( u3, u4 ) = self.cache[key]
+                        self.data[eid] = { 'U3': u3, 'U4': u4, 'current_tap': self.current_tap }
+                        continue
+
+                    # Inputs may have changed during cache hits without being set to the FMU.
+                    self.cache_misses += 1
+                    fmu_inputs = { k: v for k, v in self.inputs[eid].items()
+                        if v is not None and v != self.fmu_inputs[eid][k] }
+                    self.fmu_inputs[eid].update( fmu_inputs )
+                else:
+                    key = None
+
+                load_flows[eid] = ( fmu_inputs, self.current_tap, key )
 
-                self.data[eid] = {
-                    'U3': self.get_value( eid, 'ElmTerm_LVBus3_m:u' ),
-                    'U4': self.get_value( eid, 'ElmTerm_LVBus4_m:u' ),
-                    'current_tap': self.current_tap
-                }
+        # Calculate the load flows (possibly in parallel), then store the results in the order of the entity IDs.
+        results = self.stepper.map( lambda eid: self.calc_load_flow( eid, load_flows[eid][0], target_time ), load_flows )
+
+        for eid, ( u3, u4 ) in zip( sorted( load_flows ), results ):
+            ( _, current_tap, key ) = load_flows[eid]
+            self.data[eid] = { 'U3': u3, 'U4': u4, 'current_tap': current_tap }
+
+            if self.cache_size > 0:
+                self.cache[key] = ( u3, u4 )
+                while len( self.cache ) > self.cache_size:
+                    self.cache.popitem( last=False )
 
         return time + 1 # self.step_size
 
 
+    def calc_load_flow(self, eid, fmu_inputs, target_time):
+        '''Set the inputs of an entity's FMU, step it to the target time and return voltages (U3, U4).'''
+        self.set_values( eid, fmu_inputs, 'input' )
+
+        if self.verbose is True: print( 'FMU do step' )
+        communication_point = self.fmutimes[eid]
+        communication_step_size = target_time - self.fmutimes[eid]
+        status = self._entities[eid].doStep( communication_point + self.fmu_time_offsets[eid],
+            communication_step_size, True )
+        assert status == fmipp.fmiOK
+
+        self.fmutimes[eid] += communication_step_size
+
+        return self.get_value( eid, 'ElmTerm_LVBus3_m:u' ), self.get_value( eid, 'ElmTerm_LVBus4_m:u' )
+
+
+    def finalize(self):
+        if self.stepper is not None:
+            self.stepper.close()
+
+        if self.cache_size > 0:
+            print( 'Load flow cache: {0} hits, {1} misses'.format( self.cache_hits, self.cache_misses ) )
+
+        self.release_fmus()
+
+
+    def get_pool_state(self, eid):
+        return { 'initial_inputs': self.initial_inputs[eid] }
+
+
+    def get_cache_key(self, eid):
+        '''Quantize the current load flow inputs of an entity to the cache tolerance.'''
+        return tuple( None if v is None else int( round( v / self.cache_tolerance ) )
+            for v in ( self.inputs[eid][k] for k in LOADFLOW_INPUTS ) )
+
+
     def get_data(self, outputs):
         data = {}
         for eid, edata in self.data.items():
@@ -238,11 +331,11 @@ class TC3PowerSystem(mosaik_api.Simulator):
             assert set_stat == fmipp.fmiOK
 
 
-    def get_value(self, eid, alt_attr):
+    def get_value(self, eid, alt_attr, var_type='output'):
         '''Helper function to get output variable values from a FMU instance.'''
-        attr = self.translation_table['output'][alt_attr]
+        attr = self.translation_table[var_type][alt_attr]
         # Obtain getter function according to specified var type (Real, Integer, etc.):
-        get_func = getattr(self._entities[eid], 'get' + self.var_table['output'][attr] + 'Value')
+        get_func = getattr(self._entities[eid], 'get' + self.var_table[var_type][attr] + 'Value')
         val = get_func(attr)
         #if val is not 0: print( 'get_value func = {}, attr = {}, val = {}'.format( 'get' + self.var_table['output'][attr] + 'Value', attr, val ) )
         return val
@@ -4,6 +4,8 @@ import os
 import argparse
 from pathlib import Path
 from datetime import *
+from result_cache import ResultCache, file_digest
+from shm_transport import check_platform
 
 # Simulation stop time and scaling factor.
 MT_PER_SEC = 500 # N ticks of mosaik time = 1 second
@@ -15,18 +17,33 @@ BASH_PATH = 'C:/Tools/cygwin/bin/bash.exe'
 # FMU repository.
 FMU_DIR = os.path.abspath( os.path.join( os.path.dirname( __file__ ), 'fmus' ) )
 
+# FMUs used by the scenario (their digests are part of the result cache key).
+FMU_MODEL_NAMES = [ 'TC3_PowerSystem', 'TC3_SimICT', 'TC3_Controller' ]
+
+# Command line arguments that do not influence the simulation results.
+NON_RESULT_ARGS = [ 'output_file', 'cache_dir', 'cache_max_size', 'cache_max_age', 'fmu_pool_size', 'comm_worker', 'comm_transport' ]
+
 # Sim config.
 SIM_CONFIG = {
         'CommSim': {
             'cmd': BASH_PATH + ' -lc "./tc3_comm_ns3_fmu.sh tc3 %(addr)s"',
             'cwd': Path( os.path.abspath( os.path.dirname( __file__ ) ) ).as_posix()
         },
+        'CommSimShm':{
+            'python': 'shm_transport:ShmSimulatorProxy'
+        },
+        'CommSimDES':{
+            'python': 'tc3_comm_des:TC3CommNetwork'
+        },
         'LoadFlowSim':{
             'python': 'tc3_powersystem_pf_fmu:TC3PowerSystem'
         },
         'ControllerSim':{
             'python': 'tc3_controller_matlab_fmu:TC3Controller'
         },
+        'ControllerSimNative':{
+            'python': 'tc3_controller_native:TC3Controller'
+        },
         'RampingLoad':{
             'python': 'ramping_load:RampingLoad',
         },
@@ -42,20 +59,84 @@ SIM_CONFIG = {
     }
 
 
-def main():
-
+def create_parser():
     parser = argparse.ArgumentParser(description='Run a TC3 simulation with the SimICT component')
-    parser.add_argument( '--ctrl_dead_time', type=float, help='controller deadtime in seconds', default=1 )
-    parser.add_argument( '--send_time_diff', type=float, help='time difference between sending volatge readings', default=3 )
+    parser.add_argument( '--ctrl_dead_time', type=float, help='controller deadtime in seconds', default=1. )
+    parser.add_argument( '--send_time_diff', type=float, help='time difference between sending volatge readings', default=3. )
     parser.add_argument( '--random_seed', type=int, help='ns-3 random generator seed', default=1 )
+    parser.add_argument( '--comm', type=str, choices=[ 'ns3_fmu', 'des', 'replay' ], help='communication network simulator (ns-3 FMU, discrete-event simulation in Python or replay of a trace of the ns-3 FMU)', default='ns3_fmu' )
+    parser.add_argument( '--comm_delay_cache', action='store_true', help='reuse delays of the ns-3 FMU for messages sent by the same set of channels' )
+    parser.add_argument( '--comm_worker', type=str, help='address (HOST:PORT) of a running ns-3 FMU worker (see tc3_comm_ns3_fmu.py) to attach to instead of starting the simulator', default=None )
+    parser.add_argument( '--comm_transport', type=str, choices=[ 'tcp', 'shm' ], help='transport between mosaik and the ns-3 FMU simulator (TCP socket or shared memory, x86 only)', default='tcp' )
+    parser.add_argument( '--comm_trace', type=str, help='trace file of the ns-3 FMU (written with --comm ns3_fmu, read with --comm replay)', default=None )
+    parser.add_argument( '--controller', type=str, choices=[ 'matlab_fmu', 'native' ], help='controller (MATLAB FMU or native Python implementation)', default='matlab_fmu' )
     parser.add_argument( '--output_file', type=str, help='output file name', default='erigridstore.h5' )
-    args = parser.parse_args()
+    parser.add_argument( '--cache_dir', type=str, help='reuse results of identical runs from this directory', default=None )
+    parser.add_argument( '--cache_max_size', type=float, help='maximum size of the result cache in MB', default=None )
+    parser.add_argument( '--cache_max_age', type=float, help='maximum age of result cache entries in days', default=None )
+    parser.add_argument( '--loadflow_cache_size', type=int, help='max. number of load flow results of the PowerFactory FMU cached for reuse (0 = no caching)', default=0 )
+    parser.add_argument( '--fmu_pool_size', type=int, help='max. number of instances per FMU kept alive for reuse in consecutive runs', default=0 )
+    return parser
+
+
+def main():
+
+    args = create_parser().parse_args()
     print( 'Starting simulation with args: {0}'.format( vars( args ) ) )
 
-    world = mosaik.World( SIM_CONFIG )
+    run( args )
+
+
+def run( args, mosaik_config=None ):
+
+    cache = create_cache( args )
+    if cache is not None:
+        key = cache.key( get_cache_params( args ) )
+        if cache.get( key, args.output_file ):
+            print( 'Reusing cached result for args: {0}'.format( vars( args ) ) )
+            return
+
+    world = mosaik.World( get_sim_config( args ), mosaik_config=mosaik_config )
     create_scenario( world, args )
     world.run( until=STOP )
 
+    if cache is not None:
+        cache.put( key, args.output_file )
+        cache.evict()
+
+
+def get_sim_config( args ):
+
+    # Attach to a running worker of the ns-3 FMU simulator instead of starting it.
+    if getattr( args, 'comm_worker', None ) is not None:
+        return dict( SIM_CONFIG, CommSim={ 'connect': args.comm_worker } )
+    return SIM_CONFIG
+
+
+def create_cache( args ):
+
+    if getattr( args, 'cache_dir', None ) is None:
+        return None
+
+    # Runs that record a trace always have to be simulated.
+    if getattr( args, 'comm', 'ns3_fmu' ) == 'ns3_fmu' and getattr( args, 'comm_trace', None ) is not None:
+        return None
+
+    max_size = args.cache_max_size*1e6 if args.cache_max_size is not None else None
+    max_age = args.cache_max_age*86400 if args.cache_max_age is not None else None
+    return ResultCache( args.cache_dir, max_size=max_size, max_age=max_age )
+
+
+def get_cache_params( args ):
+
+    params = { k: v for k, v in vars( args ).items() if k not in NON_RESULT_ARGS }
+    params['MT_PER_SEC'] = MT_PER_SEC
+    params['STOP'] = STOP
+    params['fmus'] = { name: file_digest( os.path.join( FMU_DIR, name + '.fmu' ) ) for name in FMU_MODEL_NAMES }
+    if params.get( 'comm' ) == 'replay':
+        params['comm_trace'] = file_digest( args.comm_trace )
+    return params
+
 
 def create_scenario( world, args ):
 
@@ -78,21 +159,49 @@ def create_scenario( world, args ):
     loadflow_sim = world.start( 'LoadFlowSim',
         work_dir=FMU_DIR, model_name='TC3_PowerSystem', instance_name='LoadFlow1',
         start_time=0, stop_time=STOP, stop_time_defined=True,
-        step_size=1*MT_PER_SEC, seconds_per_mosaik_timestep=1/MT_PER_SEC, verbose=False )
+        step_size=1*MT_PER_SEC, seconds_per_mosaik_timestep=1/MT_PER_SEC,
+        cache_size=getattr( args, 'loadflow_cache_size', 0 ),
+        pool_size=getattr( args, 'fmu_pool_size', 0 ), verbose=False )
     loadflow = loadflow_sim.TC3PowerSystem.create(1)[0]
 
     # Simulator for communication network.
-    comm_network_sim = world.start( 'CommSim',
-        work_dir=FMU_DIR, model_name='TC3_SimICT', instance_name='CommNetwork1',
-        start_time=0, stop_time=STOP, stop_time_defined=True, random_seed=args.random_seed,
-        seconds_per_mosaik_timestep=1./MT_PER_SEC, path_conversion='win2cygwin', posix=True, verbose=False )
+    if getattr( args, 'comm', 'ns3_fmu' ) == 'des':
+        comm_network_sim = world.start( 'CommSimDES',
+            start_time=0, random_seed=args.random_seed, seconds_per_mosaik_timestep=1./MT_PER_SEC, verbose=False )
+    elif getattr( args, 'comm', 'ns3_fmu' ) == 'replay':
+        if getattr( args, 'comm_trace', None ) is None:
+            raise RuntimeError( 'replaying the communication network requires a trace file (--comm_trace)' )
+        comm_network_sim = world.start( 'CommSimDES',
+            start_time=0, random_seed=args.random_seed, seconds_per_mosaik_timestep=1./MT_PER_SEC,
+            delay_models={ channel: { 'model': 'trace', 'trace_file': args.comm_trace, 'seed': args.random_seed }
+                for channel in [ 'u3', 'u4', 'ctrl' ] }, verbose=False )
+    else:
+        # Option posix is only used by mosaik for starting the simulator (it is not passed to an attached worker).
+        start_params = { 'posix': True } if getattr( args, 'comm_worker', None ) is None else {}
+        comm_sim_name = 'CommSim'
+        if getattr( args, 'comm_transport', 'tcp' ) == 'shm' and getattr( args, 'comm_worker', None ) is None:
+            check_platform()
+            comm_sim_name = 'CommSimShm'
+            start_params = { 'shm_cmd': BASH_PATH + ' -lc "./tc3_comm_ns3_fmu.sh tc3 --shm \'{shm}\'"',
+                'shm_cwd': SIM_CONFIG['CommSim']['cwd'] }
+        comm_network_sim = world.start( comm_sim_name,
+            work_dir=FMU_DIR, model_name='TC3_SimICT', instance_name='CommNetwork1',
+            start_time=0, stop_time=STOP, stop_time_defined=True, random_seed=args.random_seed,
+            seconds_per_mosaik_timestep=1./MT_PER_SEC, path_conversion='win2cygwin',
+            delay_cache=getattr( args, 'comm_delay_cache', False ),
+            trace_file=getattr( args, 'comm_trace', None ), verbose=False, **start_params )
     comm_network = comm_network_sim.TC3CommNetwork.create(1)[0]
 
     # Simulator for controller.
-    controller_sim = world.start( 'ControllerSim',
-        work_dir=FMU_DIR, model_name='TC3_Controller', instance_name='Controller1',
-        start_time=0, stop_time=STOP, stop_time_defined=True,
-        dead_time=args.ctrl_dead_time, seconds_per_mosaik_timestep=1./MT_PER_SEC, verbose=False )
+    if getattr( args, 'controller', 'matlab_fmu' ) == 'native':
+        controller_sim = world.start( 'ControllerSimNative',
+            dead_time=args.ctrl_dead_time, seconds_per_mosaik_timestep=1./MT_PER_SEC, verbose=False )
+    else:
+        controller_sim = world.start( 'ControllerSim',
+            work_dir=FMU_DIR, model_name='TC3_Controller', instance_name='Controller1',
+            start_time=0, stop_time=STOP, stop_time_defined=True,
+            dead_time=args.ctrl_dead_time, seconds_per_mosaik_timestep=1./MT_PER_SEC,
+            pool_size=getattr( args, 'fmu_pool_size', 0 ), verbose=False )
     controller = controller_sim.TC3Controller.create(1)[0]
 
     # Connect ramping loads to power system.
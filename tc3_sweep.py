@@ -0,0 +1,190 @@
+"""
+    Run a parameter sweep of the TC3 scenario (see tc3_scenario_fmu.py) on a pool of worker processes.
+    Each point of the sweep runs in its own mosaik world and writes its own output file.
+"""
+
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import time as timer
+
+import tc3_scenario_fmu
+
+# Scenario parameters that can be swept.
+SWEEP_PARAMS = [ 'ctrl_dead_time', 'send_time_diff', 'random_seed' ]
+
+# Number of ports each worker cycles through, so that consecutive runs of a worker
+# do not have to bind to a port that is still in use by the previous run.
+PORTS_PER_WORKER = 10
+
+# Port assignment of the current worker process (set by init_worker).
+worker_slot = None
+worker_runs = 0
+worker_ports = None
+worker_comm_worker = None
+
+
+def grid_points( grid ):
+    '''Return all combinations of the parameter values in grid (dict of parameter names and lists of values).'''
+    names = sorted( grid )
+    return [ dict( zip( names, values ) ) for values in itertools.product( *[ grid[name] for name in names ] ) ]
+
+
+def read_points( filename ):
+    '''Read sweep points from a CSV file with one point per row and one column per parameter.'''
+    actions = { action.dest: action for action in tc3_scenario_fmu.create_parser()._actions }
+    with open( filename, newline='' ) as f:
+        reader = csv.DictReader( f )
+        unknown = set( reader.fieldnames or [] ) - set( SWEEP_PARAMS )
+        if unknown:
+            raise RuntimeError( 'Unknown sweep parameters in {0}: {1}'.format( filename, sorted( unknown ) ) )
+
+        points = []
+        for row in reader:
+            # csv.DictReader fills short rows with None and collects extra values under key None.
+            if any( name is None or val is None or val.strip() == '' for name, val in row.items() ):
+                raise RuntimeError( 'Missing or extra values in line {0} of {1}'.format( reader.line_num, filename ) )
+            points.append( { name: actions[name].type( val ) for name, val in row.items() } )
+        return points
+
+
+def output_file_name( point ):
+    return 'tc3_dead{ctrl_dead_time}_diff{send_time_diff}_seed{random_seed}.h5'.format( **point )
+
+
+def complete_points( points, output_dir ):
+    '''Add default values for missing parameters and an output file to each point.'''
+    defaults = vars( tc3_scenario_fmu.create_parser().parse_args( [] ) )
+
+    completed = []
+    for point in points:
+        unknown = set( point ) - set( SWEEP_PARAMS )
+        if unknown:
+            raise RuntimeError( 'Unknown sweep parameters: {0}'.format( sorted( unknown ) ) )
+
+        args = dict( defaults, **point )
+        args['output_file'] = os.path.join( output_dir, output_file_name( args ) )
+        completed.append( args )
+
+    return completed
+
+
+def init_worker( slots, base_port, workers, comm_workers ):
+    '''Assign a unique slot to the worker process, which determines the ports it uses for mosaik
+    (and the ns-3 FMU worker it attaches to, if any).'''
+    global worker_slot, worker_ports, worker_comm_worker
+    worker_slot = slots.get()
+    worker_ports = [ base_port + worker_slot + i*workers for i in range( PORTS_PER_WORKER ) ]
+    if comm_workers:
+        worker_comm_worker = comm_workers[worker_slot]
+
+
+def run_point( point ):
+    '''Run a single point of the sweep (called in a worker process).'''
+    global worker_runs
+    port = worker_ports[ worker_runs % PORTS_PER_WORKER ]
+    worker_runs += 1
+
+    if worker_comm_worker is not None:
+        point = dict( point, comm_worker=worker_comm_worker )
+
+    start = timer.time()
+    try:
+        tc3_scenario_fmu.run( argparse.Namespace( **point ), mosaik_config={ 'addr': ( '127.0.0.1', port ) } )
+        error = None
+    except Exception as e:
+        error = '{0}: {1}'.format( type( e ).__name__, e )
+
+    return point, timer.time() - start, error
+
+
+def run_sweep( points, workers=None, base_port=5555, comm_workers=None ):
+    '''Run all points on a pool of worker processes and report progress. Each worker process attaches
+    to its own running ns-3 FMU worker from list *comm_workers* (addresses HOST:PORT), if given.
+    Returns a list of (point, duration, error) tuples in the order the runs finished.'''
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = max( 1, min( workers, len( points ) ) )
+    if comm_workers:
+        workers = min( workers, len( comm_workers ) )
+
+    slots = multiprocessing.Queue()
+    for slot in range( workers ):
+        slots.put( slot )
+
+    results = []
+    start = timer.time()
+    pool = multiprocessing.Pool( workers, initializer=init_worker, initargs=( slots, base_port, workers, comm_workers ) )
+    try:
+        for point, duration, error in pool.imap_unordered( run_point, points ):
+            results.append( ( point, duration, error ) )
+
+            n_done = len( results )
+            elapsed = timer.time() - start
+            eta = elapsed / n_done * ( len( points ) - n_done )
+            print( '[{0}/{1}] {2} {3} after {4:.1f} s - elapsed: {5:.0f} s, ETA: {6:.0f} s'.format(
+                n_done, len( points ), { name: point[name] for name in SWEEP_PARAMS },
+                'FAILED ({0})'.format( error ) if error else 'done', duration, elapsed, eta ) )
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
+
+
+def write_summary( results, filename ):
+    '''Write one row per point with its parameters, output file, run time and error (if any).'''
+    fields = SWEEP_PARAMS + [ 'output_file', 'duration', 'error' ]
+    with open( filename, 'w', newline='' ) as f:
+        writer = csv.DictWriter( f, fieldnames=fields, extrasaction='ignore' )
+        writer.writeheader()
+        for point, duration, error in results:
+            writer.writerow( dict( point, duration=duration, error=error or '' ) )
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Run a parameter sweep of the TC3 simulation on a process pool')
+    parser.add_argument( '--ctrl_dead_time', type=float, nargs='+', help='controller deadtimes in seconds' )
+    parser.add_argument( '--send_time_diff', type=float, nargs='+', help='time differences between sending voltage readings' )
+    parser.add_argument( '--random_seed', type=int, nargs='+', help='ns-3 random generator seeds' )
+    parser.add_argument( '--points', type=str, help='CSV file with one point per row (instead of a parameter grid)' )
+    parser.add_argument( '--output_dir', type=str, help='directory for output files', default='sweep_results' )
+    parser.add_argument( '--workers', type=int, help='number of worker processes', default=multiprocessing.cpu_count() )
+    parser.add_argument( '--base_port', type=int, help='first port used for mosaik', default=5555 )
+    parser.add_argument( '--cache_dir', type=str, help='reuse results of identical runs from this directory', default=None )
+    parser.add_argument( '--cache_max_size', type=float, help='maximum size of the result cache in MB', default=None )
+    parser.add_argument( '--cache_max_age', type=float, help='maximum age of result cache entries in days', default=None )
+    parser.add_argument( '--loadflow_cache_size', type=int, help='max. number of load flow results cached per worker and reused across points', default=0 )
+    parser.add_argument( '--fmu_pool_size', type=int, help='max. number of instances per FMU and worker kept alive for reuse', default=0 )
+    parser.add_argument( '--comm_workers', type=str, nargs='+', help='addresses (HOST:PORT) of running ns-3 FMU workers, one per worker process' )
+    args = parser.parse_args()
+
+    if args.points is not None:
+        points = read_points( args.points )
+    else:
+        points = grid_points( { name: getattr( args, name ) for name in SWEEP_PARAMS if getattr( args, name ) is not None } )
+
+    if not os.path.isdir( args.output_dir ):
+        os.makedirs( args.output_dir )
+    points = complete_points( points, args.output_dir )
+    for point in points:
+        point.update( cache_dir=args.cache_dir, cache_max_size=args.cache_max_size, cache_max_age=args.cache_max_age,
+            fmu_pool_size=args.fmu_pool_size, loadflow_cache_size=args.loadflow_cache_size )
+
+    print( 'Starting sweep with {0} points on {1} workers'.format( len( points ), args.workers ) )
+    results = run_sweep( points, args.workers, args.base_port, args.comm_workers )
+    write_summary( results, os.path.join( args.output_dir, 'sweep_summary.csv' ) )
+
+    n_failed = sum( 1 for _, _, error in results if error )
+    if n_failed: print( '{0} of {1} runs failed'.format( n_failed, len( results ) ) )
+
+
+if __name__ == '__main__':
+    sweep_start_time = timer.time()
+
+    main()
+
+    print( 'sweep took {} seconds'.format( timer.time() - sweep_start_time ) )
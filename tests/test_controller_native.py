@@ -0,0 +1,68 @@
+'''
+    Test the native controller against the tap decisions of the MATLAB FMU controller (decideOnTap in
+    fmus/matlab_controller_fmu/TC3_Controller.m and the dead time handling of tc3_controller_matlab_fmu.py).
+'''
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+
+from tc3_controller_native import TC3Controller
+
+
+# Voltage trace (time, u3, u4; None = no input) and expected output 'tap' after each step, for a dead time
+# of 2 time steps and limits vlow = 0.95, vup = 1.05. The FMU keeps its last inputs (initially 1.0).
+TRACE = [
+    ( 0, None, None, None ),    # no inputs, no output
+    ( 1, 1.06, None, None ),    # only u3, above vup: tap 1, dead time until 3 (no output)
+    ( 2, None, 0.90, None ),    # dead time: input ignored
+    ( 3, None, 0.94, 1 ),       # end of dead time: input ignored, tap output
+    ( 4, None, None, None ),    # responsive without inputs: no output
+    ( 5, None, 0.94, None ),    # only u4 below vlow, u3 still 1.06 above vup: +1 -1 = tap 1
+    ( 6, None, None, None ),
+    ( 7, None, None, 1 ),
+    ( 8, 0.93, 0.94, None ),    # both below vlow: tap 0
+    ( 9, None, None, None ),
+    ( 10, 1.06, 1.07, 0 ),      # dead time ends: inputs ignored
+    ( 11, 1.06, 1.07, None ),   # both above vup: tap 1
+    ( 12, None, None, None ),
+    ( 13, None, None, 1 ),
+    ( 14, 1.0, 1.0, None ),     # within limits: tap unchanged
+    ( 15, None, None, None ),
+    ( 16, None, None, 1 ),
+]
+
+
+@pytest.fixture
+def controller():
+    controller = TC3Controller()
+    controller.init( 'Controller', dead_time=2, seconds_per_mosaik_timestep=1 )
+    return controller
+
+
+def get_inputs( u3, u4 ):
+    inputs = {}
+    if u3 is not None: inputs['u3'] = { 'Comm.u3_receive': u3 }
+    if u4 is not None: inputs['u4'] = { 'Comm.u4_receive': u4 }
+    return inputs
+
+
+def test_trace( controller ):
+    [ eid ] = [ entity['eid'] for entity in controller.create( 1, 'TC3Controller' ) ]
+
+    for ( time, u3, u4, tap ) in TRACE:
+        controller.step( time, { eid: get_inputs( u3, u4 ) } )
+        assert controller.get_data( { eid: [ 'tap' ] } )[eid]['tap'] == tap, 'time {0}'.format( time )
+
+
+def test_entities_are_independent( controller ):
+    [ eid, idle ] = [ entity['eid'] for entity in controller.create( 2, 'TC3Controller' ) ]
+
+    for ( time, u3, u4, tap ) in TRACE:
+        controller.step( time, { eid: get_inputs( u3, u4 ), idle: {} } )
+        data = controller.get_data( { eid: [ 'tap' ], idle: [ 'tap' ] } )
+        assert data[eid]['tap'] == tap, 'time {0}'.format( time )
+        assert data[idle]['tap'] is None
@@ -0,0 +1,80 @@
+'''
+    Test the NumPy load flow simulator through a mosaik world (in-process).
+'''
+
+import math
+import os
+import sys
+
+import mosaik
+import pytest
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+
+from tc3_powersystem_numpy import LVNetwork
+
+
+SIM_CONFIG = {
+    'LoadFlowSimNumpy': {
+        'python': 'tc3_powersystem_numpy:TC3PowerSystem'
+    },
+}
+
+
+@pytest.fixture
+def world():
+    world = mosaik.World( SIM_CONFIG )
+    yield world
+    world.shutdown()
+
+
+def test_create_with_params( world ):
+    loadflow_sim = world.start( 'LoadFlowSimNumpy', step_size=1 )
+    loadflow = loadflow_sim.TC3PowerSystem.create( 1, L_3=1., L_4=8. )[0]
+
+    data = world.get_data( [ loadflow ], 'U3', 'U4', 'current_tap' )[ loadflow ]
+    assert data['current_tap'] == 0
+    assert 0.8 < data['U3'] < 1.1
+    assert 0.8 < data['U4'] < 1.1
+
+
+def test_create_replicas( world ):
+    loadflow_sim = world.start( 'LoadFlowSimNumpy', step_size=1 )
+    single = loadflow_sim.TC3PowerSystem.create( 1, L_3=1., L_4=8. )[0]
+    ensemble = loadflow_sim.TC3PowerSystem.create( 1, L_3=1., L_4=8., replicas=3 )[0]
+
+    data = world.get_data( [ single, ensemble ], 'U3', 'U4' )
+    for attr in [ 'U3', 'U4' ]:
+        assert len( data[ ensemble ][ attr ] ) == 3
+        assert data[ ensemble ][ attr ] == pytest.approx( [ data[ single ][ attr ] ]*3 )
+
+
+def get_test_network( load_buses ):
+    '''Two buses connected by a resistive line (and an ideal transformer): with a load P at the end of the line,
+    the voltage is the solution of V^2 - V + r*P = 0 (in p.u.).'''
+    network = {
+        's_base': 100.,
+        'v_base': 400.,
+        'v_slack': 1.0,
+        'trafo': { 'lv_bus': 'LVBus1', 'r': 0., 'x': 0., 'tap_step': 0.025 },
+        'lines': [ ( 'LVBus1', 'LVBus2', 0.2, 0. ) ],
+        'loads': { attr: ( bus, 1. ) for attr, bus in load_buses.items() },
+        'outputs': { 'U2': 'LVBus2' },
+    }
+    return LVNetwork( network )
+
+
+def test_solve_two_buses():
+    network = get_test_network( { 'L_3': 'LVBus2', 'L_4': 'LVBus1' } )
+
+    # r = 0.2 Ohm / 1.6 Ohm = 0.125 p.u., P = 8 kW / 100 kVA = 0.08 p.u.
+    v = network.solve( [ 8., 0. ], 0 )
+    assert network.get_voltages( v )[0] == pytest.approx( ( 1. + math.sqrt( 1. - 4*0.125*0.08 ) )/2., abs=1e-9 )
+    assert network.get_voltages( v )[0] == pytest.approx( 0.98990, abs=1e-5 )
+
+
+def test_solve_loads_on_same_bus():
+    network = get_test_network( { 'L_3': 'LVBus2', 'L_4': 'LVBus2' } )
+
+    v = network.solve( [ 5., 3. ], 0 )
+    assert network.get_voltages( v )[0] == pytest.approx( 0.98990, abs=1e-5 )